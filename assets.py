@@ -0,0 +1,71 @@
+import pygame
+from collections import Counter
+
+
+# Loads assets by name the first time they are needed and keeps them.
+# Assets a level needs are required: they go first and the level waits for them, the rest is
+# prefetched one asset per poll so loading never holds up a frame for long.
+class AssetManager:
+    def __init__(self, sources: dict, load=pygame.mixer.Sound):
+        self.sources = sources # Filename by name
+        self.load = load
+        self.cache = {}
+        self.refs = Counter() # Levels (or anything else) using each asset
+        self.required = [] # Loaded before anything in queue
+        self.queue = []
+        self.total = 0 # Required assets since the last time everything required was loaded
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.cache
+
+    # Returns the asset, loading it right away if it isn't loaded yet
+    def get(self, name: str):
+        asset = self.cache.get(name)
+        if asset is None:
+            asset = self.cache[name] = self.load(self.sources[name])
+        return asset
+
+    def require(self, names):
+        for name in names:
+            if name not in self.cache and name not in self.required:
+                self.required.append(name)
+                self.total += 1
+
+    def prefetch(self, names):
+        for name in names:
+            if name not in self.cache and name not in self.queue:
+                self.queue.append(name)
+
+    def acquire(self, names):
+        self.refs.update(names)
+        self.require(names)
+
+    def release(self, names):
+        self.refs.subtract(names)
+
+    # Drops the assets nothing uses anymore, they are loaded again if they are needed later
+    def purge(self):
+        for name, refs in list(self.refs.items()):
+            if refs <= 0:
+                self.cache.pop(name, None)
+                del self.refs[name]
+
+    # Loads one asset, required ones first
+    def poll(self):
+        queue = self.required or self.queue
+        while queue:
+            name = queue.pop(0)
+            if name not in self.cache:
+                self.get(name)
+                break
+        if not self.required:
+            self.total = 0
+
+    def ready(self) -> bool:
+        return all(name in self.cache for name in self.required)
+
+    # Fraction of the required assets that are loaded
+    def progress(self) -> float:
+        if not self.total:
+            return 1.0
+        return 1 - sum(name not in self.cache for name in self.required) / self.total
@@ -1,6 +1,5 @@
 import pygame
-from pygame.math import Vector2 as vec2
-from random import uniform
+from random import uniform, randrange
 
 from constants import *
 
@@ -19,43 +18,39 @@ class BackgroundColor(Background):
     def draw(self):
         self.gm.screen.fill(self.color)
 
-class Star:
-    def __init__(self, position: vec2, velocity: vec2):
-        self.position = position
-        self.velocity = velocity
-    
-    def update(self):
-        self.position += self.velocity
-    
-    def draw(self, surf: pygame.Surface):
-        pygame.draw.rect(surf, (100,100,120), [self.position.x, self.position.y, 1, 1])
-
+# Stars share STAR_LAYERS velocities: the stars of a velocity are drawn once on a colour keyed layer,
+# and moving them all is moving the layer. Run length encoding makes a layer cost about what its stars do
+# to blit, so an update is a few blits whatever the star count. Stars wrap around the edges of the screen.
 class BackgroundStars(Background):
-    def __init__(self, gm, target=20):
+    def __init__(self, gm, target=STAR_COUNT, layers=STAR_LAYERS):
         super().__init__(gm)
         self.target = target
         self.surf = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
         self.dimmer = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
         self.dimmer.fill((3,3,3))
-        self.stars = []
-    
+        star = pygame.Surface((1, 1))
+        star.fill((100,100,120))
+
+        self.layers = []
+        for layer in range(layers):
+            surf = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            stars = target // layers + (layer < target % layers)
+            surf.fblits([(star, (randrange(int(SCREEN_WIDTH)), randrange(int(SCREEN_HEIGHT)))) for i in range(stars)])
+            surf.set_colorkey((0,0,0), pygame.RLEACCEL)
+            self.layers.append([surf, 0.0, 0.0, uniform(-.3,.3), uniform(-.3,.3)]) # Surface, offset, velocity
 
     def update(self):
-        deadStars = []
-        screen_rect = pygame.Rect(0,0,SCREEN_WIDTH, SCREEN_HEIGHT)
-
-        for i in range(self.target-len(self.stars)):
-            self.stars.append(Star(vec2(uniform(0, SCREEN_WIDTH), uniform(0, SCREEN_HEIGHT)), vec2(uniform(-.3,.3),uniform(-.3,.3))))
-        for s in self.stars:
-            s.update()
-            if not screen_rect.collidepoint(s.position):
-                deadStars.append(s)
-        for s in deadStars:
-            self.stars.remove(s)
+        blits = []
+        for layer in self.layers:
+            surf, x, y, vx, vy = layer
+            x = layer[1] = (x + vx) % SCREEN_WIDTH
+            y = layer[2] = (y + vy) % SCREEN_HEIGHT
+            x, y = int(x), int(y)
+            blits += (surf, (x, y)), (surf, (x - SCREEN_WIDTH, y)), (surf, (x, y - SCREEN_HEIGHT)), (surf, (x - SCREEN_WIDTH, y - SCREEN_HEIGHT))
+
+        # The trails fade once per update so their length doesn't depend on the frame rate
+        self.surf.fblits(blits)
+        self.surf.blit(self.dimmer, (0,0), special_flags=pygame.BLEND_RGB_SUB)
     
     def draw(self):
-        for s in self.stars:
-            s.draw(self.surf)
-        
-        self.surf.blit(self.dimmer, (0,0), special_flags=pygame.BLEND_RGB_SUB)
-        self.gm.screen.blit(self.surf, (0,0))
\ No newline at end of file
+        self.gm.screen.blit(self.surf, (0,0))
@@ -0,0 +1,293 @@
+# Benchmarks of the game's hot paths, run headless with the SDL dummy drivers.
+#   python benchmark.py -o results.json                   Run and save the results
+#   python benchmark.py --baseline results.json           Compare against saved results, exit 1 on regressions
+
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import gc
+import sys
+import json
+import random
+import tempfile
+import timeit
+import argparse
+import platform
+import statistics
+import tracemalloc
+from itertools import cycle
+
+import pygame
+
+from constants import *
+from simulation import *
+from backgrounds import BackgroundStars
+from levelpack import pack_directory, write_pack
+from solver import solve, FRAMES_PER_MOVE
+from generate_levels import random_candidate, write_levels, GeneratorOptions
+from present import PRESENTERS, PRESENT_DEFAULT
+
+
+BENCHMARK_REPEAT = 7 # Timed rounds per benchmark, the statistics are taken over these
+BENCHMARK_THRESHOLD = .25 # Allowed slowdown of the median against the baseline
+BENCHMARK_SEED = 0
+BENCHMARK_MEMORY_SIZE = 1000 # Width and height of the level memory is measured on, a million tiles
+BENCHMARK_SOLVE_SIZE = 100 # Width and height of the generated level solve_large solves
+BENCHMARK_SOLVE_SEED = 1 # Its candidate seed, the hardest of the first few at that size
+
+BENCHMARK_PACK = os.path.join(tempfile.gettempdir(), 'benchmark.pack') # Written by the level pack benchmarks
+BENCHMARK_LEVELS = os.path.join(tempfile.gettempdir(), 'benchmark_levels') # Level directory written by level_get_huge
+
+BENCHMARKS = {} # name: (setup, calls per round)
+
+# Registers a setup function, it gets the game and returns the function to time
+def benchmark(name: str, number: int):
+    def register(setup):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+    return register
+
+
+# Random floors, walls and timed tiles with the start in a corner and the goal in the opposite one
+def generate_level(width: int, height: int, seed=BENCHMARK_SEED) -> Level:
+    rng = random.Random(seed)
+    tiles = bytearray(rng.choices((TILE_FLOOR, TILE_WALL, TILE_TIMED, TILE_NONE), (6, 2, 1, 1), k=width*height))
+    tiles[0] = TILE_START
+    tiles[-1] = TILE_GOAL
+    data = {'die_layout': [0,1,2,3,4,5], 'background': 'classic', 'music': [], 'texts': []}
+    return Level(width, height, tiles, data)
+
+
+# Getting levels that aren't cached, decoded from their images or read from a pack
+@benchmark('level_get_dir', 200)
+def level_get_dir(gm):
+    levels = LevelRepository(LEVELS_DIRECTORY, cache_size=0)
+    lvls = cycle(range(len(levels)))
+    return lambda: levels.get(next(lvls))
+
+# Decoding a 1024x1024 level image, what loading a big level costs without a pack
+@benchmark('level_get_huge', 5)
+def level_get_huge(gm):
+    level = generate_level(1024, 1024)
+    data = {'die_layout': list(level.die_layout.faces()), 'background': level.background, 'music': level.music, 'texts': level.texts}
+    write_levels(BENCHMARK_LEVELS, [{'tiles': level.tiles, 'data': data}], level.width, level.height)
+    levels = LevelRepository(BENCHMARK_LEVELS, cache_size=0)
+    return lambda: levels.get(0)
+
+@benchmark('level_get_pack', 200)
+def level_get_pack(gm):
+    pack_directory(LEVELS_DIRECTORY, BENCHMARK_PACK)
+    levels = LevelRepository(BENCHMARK_PACK, cache_size=0)
+    lvls = cycle(range(len(levels)))
+    return lambda: levels.get(next(lvls))
+
+# Writes a pack with a 1024x1024 level to BENCHMARK_PACK
+def write_huge_pack():
+    level = generate_level(1024, 1024)
+    data = {'die_layout': list(level.die_layout.faces()), 'background': level.background, 'music': level.music, 'texts': level.texts}
+    write_pack(BENCHMARK_PACK, [(level.width, level.height, level.tiles, data)])
+
+# Opening a pack with a 1024x1024 level and getting that level, neither depends on the size of the pack
+@benchmark('pack_open_huge', 200)
+def pack_open_huge(gm):
+    write_huge_pack()
+    return lambda: LevelRepository(BENCHMARK_PACK, cache_size=0).get(0)
+
+# Drawing a level with the camera moving over it, chunks are baked and evicted as it goes
+def pan_camera(gm, level: Level):
+    gm.isometric.load(level)
+    camera = gm.camera
+    def run():
+        camera.current.move_ip(3, 2)
+        camera.interpolate(1)
+        gm.isometric.update()
+        gm.isometric.draw()
+    return run
+
+@benchmark('iso_draw_huge', 500)
+def iso_draw_huge(gm):
+    return pan_camera(gm, generate_level(1024, 1024))
+
+# The same level read from a pack, its tile chunks are decoded and evicted as the camera moves as well
+@benchmark('pack_draw_huge', 500)
+def pack_draw_huge(gm):
+    write_huge_pack()
+    return pan_camera(gm, LevelRepository(BENCHMARK_PACK).get(0))
+
+# Collision checks and rolling, the simulation's step replaced IsoDie's collision check
+@benchmark('step', 5000)
+def step_moves(gm):
+    state = [initial_state(generate_level(64, 64))]
+    moves = cycle(MOVES)
+    def run():
+        state[0] = step(state[0], next(moves))[0]
+    return run
+
+# A big level with about 1600 timed tiles, 20 of them vanishing and coming back over and over
+@benchmark('tick_timed', 5000)
+def tick_timed(gm):
+    level = generate_level(128, 128)
+    scheduled = initial_state(level)._replace(schedule=tuple((slot*3 + 1, slot) for slot in range(20)))
+    state = [scheduled]
+    def run():
+        state[0] = tick(state[0])[0]
+        if not state[0].schedule:
+            state[0] = scheduled
+    return run
+
+# A generated level with about 1000 timed tiles and a 42 roll solution, generate_levels grades candidates with solve
+@benchmark('solve_large', 1)
+def solve_large(gm):
+    size = BENCHMARK_SOLVE_SIZE
+    tiles, data = random_candidate(BENCHMARK_SOLVE_SEED, GeneratorOptions(size, size, 5, 0, 0, 0, 0, 0, FRAMES_PER_MOVE))
+    state = initial_state(Level(size, size, tiles, data))
+    if not solve(state).solved:
+        raise RuntimeError(f'solve_large: candidate {BENCHMARK_SOLVE_SEED} should be solvable')
+    return lambda: solve(state)
+
+@benchmark('die_update_tex', 5000)
+def die_update_tex(gm):
+    layouts = cycle(DieLayout(0,1,2,3,4,5).rolls + DieLayout(5,4,3,2,1,0).rolls)
+    def run():
+        gm.die.layout = next(layouts)
+        gm.die.update_tex()
+    return run
+
+@benchmark('text_blit', 2000)
+def text_blit(gm):
+    # Mostly cached strings with a cache miss now and then, like a typer or a level counter
+    texts = cycle([f'LVL:{i % 12}' for i in range(200)] + [f'SCORE {i}' for i in range(20)])
+    position = (5, 5)
+    return lambda: gm.text_manager.blit(next(texts), position)
+
+@benchmark('iso_update', 2000)
+def iso_update(gm):
+    gm.load(0)
+    position = (2, 2, 1)
+    frame = cycle(range(4))
+    def run():
+        if not next(frame):
+            gm.isometric.spawn_text('6', position)
+        gm.isometric.update()
+    return run
+
+# Moving, stamping and fading the stars all happen in update, drawing is a single blit of the result
+@benchmark('stars_update', 500)
+def stars_update(gm):
+    stars = BackgroundStars(gm, 1000)
+    return stars.update
+
+# Everything the main loop does except waiting for the clock, once for each way of presenting a frame.
+# frame is the software presenter, frame_unchanged skips presenting the frames that didn't change,
+# which is every frame once the first level's text has been typed.
+def frame_benchmark(mode: str, skip_unchanged=False):
+    def setup(gm):
+        gm.set_presenter(PRESENTERS[mode](skip_unchanged))
+        gm.load(0)
+        def run():
+            gm.update()
+            gm.draw()
+            gm.presenter.present()
+        return run
+    return setup
+
+benchmark('frame', 200)(frame_benchmark('software'))
+benchmark('frame_scaled', 200)(frame_benchmark('scaled'))
+benchmark('frame_renderer', 200)(frame_benchmark('renderer'))
+benchmark('frame_unchanged', 200)(frame_benchmark(PRESENT_DEFAULT, True))
+
+
+def make_game():
+    from main import DiceGame
+    return DiceGame()
+
+# Microseconds per call over every round
+def run_benchmark(gm, name: str, repeat=BENCHMARK_REPEAT) -> dict:
+    setup, number = BENCHMARKS[name]
+    random.seed(BENCHMARK_SEED)
+    function = setup(gm)
+    function() # Warm up caches
+    rounds = [t / number * 1e6 for t in timeit.Timer(function).repeat(repeat, number)]
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min': min(rounds),
+        'median': statistics.median(rounds),
+        'mean': statistics.fmean(rounds),
+        'stdev': statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+    }
+
+# Bytes per tile taken by a level and by loading it into Isometric, measured with tracemalloc
+def measure_memory(gm, size=BENCHMARK_MEMORY_SIZE) -> dict:
+    gm.isometric.load(gm.levels.get(0)) # So no big level is freed while measuring
+    gc.collect()
+    tracemalloc.start()
+    level = generate_level(size, size)
+    level_bytes = tracemalloc.get_traced_memory()[0]
+    gm.isometric.load(level)
+    isometric_bytes = tracemalloc.get_traced_memory()[0] - level_bytes
+    tracemalloc.stop()
+    tiles = size*size
+    return {'tiles': tiles, 'level': level_bytes / tiles, 'isometric': isometric_bytes / tiles, 'total': (level_bytes + isometric_bytes) / tiles}
+
+def run_benchmarks(names=None, repeat=BENCHMARK_REPEAT, memory_size=BENCHMARK_MEMORY_SIZE) -> dict:
+    gm = make_game()
+    return {
+        'python': platform.python_version(),
+        'pygame': pygame.version.ver,
+        'platform': platform.platform(),
+        'results': {name: run_benchmark(gm, name, repeat) for name in names or BENCHMARKS},
+        'memory': measure_memory(gm, memory_size) if memory_size else None,
+    }
+
+# Returns (name, baseline, current, ratio) for the medians of the benchmarks found in both runs,
+# and for the bytes per tile if both measured them
+def compare(baseline: dict, current: dict) -> list:
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base:
+            rows.append((name, base['median'], result['median'], result['median'] / base['median']))
+    if baseline.get('memory') and current.get('memory'):
+        base, total = baseline['memory']['total'], current['memory']['total']
+        rows.append(('bytes_per_tile', base, total, total / base))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the hot paths of the game with the SDL dummy drivers.')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, all by default: {", ".join(BENCHMARKS)}')
+    parser.add_argument('-r', '--repeat', type=int, default=BENCHMARK_REPEAT, help='timed rounds per benchmark')
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    parser.add_argument('-b', '--baseline', help='JSON results to compare against')
+    parser.add_argument('-m', '--memory-size', type=int, default=BENCHMARK_MEMORY_SIZE, help='side of the level memory is measured on, 0 to skip')
+    parser.add_argument('-t', '--threshold', type=float, default=BENCHMARK_THRESHOLD, help='allowed slowdown of the median, .25 is 25%%')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name}')
+
+    current = run_benchmarks(args.names, args.repeat, args.memory_size)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=4)
+
+    print(f'{"benchmark":<16}{"median us":>12}{"stdev":>10}{"min":>12}')
+    for name, result in current['results'].items():
+        print(f'{name:<16}{result["median"]:>12.2f}{result["stdev"]:>10.2f}{result["min"]:>12.2f}')
+    memory = current['memory']
+    if memory:
+        print(f'\n{memory["tiles"]} tiles, bytes per tile: level {memory["level"]:.2f}, isometric {memory["isometric"]:.2f}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressed = False
+        print(f'\n{"benchmark":<16}{"baseline":>12}{"current":>12}{"change":>9}')
+        for name, base, median, ratio in compare(baseline, current):
+            slower = ratio > 1 + args.threshold
+            regressed |= slower
+            print(f'{name:<16}{base:>12.2f}{median:>12.2f}{ratio-1:>+9.1%}' + ('  REGRESSED' if slower else ''))
+        sys.exit(1 if regressed else 0)
@@ -1 +1,2 @@
-python -m pygbag --archive --git --template mobile.tmpl .
\ No newline at end of file
+python levelpack.py
+python -m pygbag --archive --git --template mobile.tmpl .
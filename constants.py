@@ -6,10 +6,33 @@ SCREEN_WIDTH = WINDOW_WIDTH/RATIO
 SCREEN_HEIGHT = WINDOW_HEIGHT/RATIO
 HALF_SCREEN_WIDTH = SCREEN_WIDTH/2
 HALF_SCREEN_HEIGHT = SCREEN_HEIGHT/2
-FPS = 60
+FPS = 60 # Maximum rendered frames per second
+TICK_RATE = 60 # Updates per second, timers, typers, particles and the camera all count updates
+TICK_TIME = 1000/TICK_RATE # Milliseconds per update
+MAX_TICKS_PER_FRAME = 5 # Updates run before a frame is drawn when the game falls behind, time past that is dropped
 
 TOUCH_SIZE = 26
 TOUCH_PADDING = 6
 
 MV_OP_SIZE = 10
-MV_OP_PADDING = 2
\ No newline at end of file
+MV_OP_PADDING = 2
+
+# Sounds by name, the music of a level refers to these names
+SOUNDS = {
+    'step': 'sfx/step.wav',
+    'pink': 'sfx/pink.ogg',
+    'stars': 'sfx/stars.ogg',
+    'type': 'sfx/type.wav',
+    'reset': 'sfx/reset.wav',
+    'win': 'sfx/win.wav',
+    'invalid': 'sfx/invalid.wav',
+    'blip': 'sfx/blip.wav',
+}
+
+MUSIC_STREAMS = ('stars',) # Music played straight from its file instead of being decoded up front, at most one at a time
+LOADING_BAR_WIDTH = 100
+LOADING_BAR_HEIGHT = 4
+
+BACKGROUNDS = ('classic', 'stars')
+STAR_COUNT = 20 # Stars on screen in the stars background
+STAR_LAYERS = 16 # Velocities the stars are spread over, the cost of an update grows with these and not with the stars
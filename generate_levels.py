@@ -0,0 +1,170 @@
+# Generates random levels over all cores and keeps the ones whose optimal solution falls in a difficulty band.
+# Writes them as a level directory (dat.json and level images) that the game and validate_levels.py can read.
+#   python generate_levels.py OUTPUT [--count N] [--min-moves N] [--max-moves N] [--workers N] [--seed N]
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from constants import BACKGROUNDS
+from simulation import *
+from solver import solve, FRAMES_PER_MOVE
+
+
+GENERATOR_BATCH = 256 # Candidates handed to the pool at a time
+GENERATOR_MAX_CANDIDATES = 100000 # Gives up after this many candidates, in case the band can't be met
+GENERATOR_MAX_STATES = 20000 # Candidates that need more search than this are rejected
+
+# Weights of the tiles a candidate is filled with, before the start and goal are placed
+GENERATOR_TILE_WEIGHTS = {
+    TILE_FLOOR: 60,
+    TILE_WALL: 15,
+    TILE_TIMED: 10,
+    TILE_NONE: 15,
+}
+
+GeneratorOptions = namedtuple('GeneratorOptions', (
+    'width', 'height',
+    'max_face', # Highest face value of the die, a face of n moves the die n+1 tiles
+    'min_moves', 'max_moves', # Band of the optimal solution length
+    'min_branching', 'max_branching', # Band of the states reached per state explored
+    'max_states', 'frames_per_move',
+))
+
+
+def random_candidate(seed: int, options: GeneratorOptions):
+    rng = random.Random(seed)
+    width, height = options.width, options.height
+    tiles = bytearray(rng.choices(list(GENERATOR_TILE_WEIGHTS), list(GENERATOR_TILE_WEIGHTS.values()), k=width*height))
+
+    # The goal is at least a third of the way across the level from the start
+    start = rng.randrange(width*height)
+    sx, sy = start % width, start // width
+    far = [i for i in range(width*height) if abs(i % width - sx) + abs(i // width - sy) >= (width + height) // 3]
+    goal = rng.choice(far) if far else rng.randrange(width*height)
+    tiles[start] = TILE_START
+    tiles[goal] = TILE_GOAL
+
+    background = rng.choice(BACKGROUNDS)
+    data = {
+        'die_layout': [rng.randint(0, options.max_face) for face in range(6)],
+        'background': background,
+        'music': ['pink', 'stars'] if background == 'stars' else ['pink'],
+        'texts': [],
+    }
+    return tiles, data
+
+# Builds and grades one candidate, returns (reason it was rejected or None, level entry)
+def evaluate_candidate(seed: int, options: GeneratorOptions):
+    tiles, data = random_candidate(seed, options)
+    if tiles.count(TILE_START) != 1 or TILE_GOAL not in tiles:
+        return 'no start or goal', None
+
+    # Solutions longer than the band are pruned during the search, so hard candidates are dropped early
+    level = Level(options.width, options.height, tiles, data)
+    result = solve(initial_state(level), options.frames_per_move, options.max_states, options.max_moves)
+    if not result.solved:
+        return 'too hard' if result.explored < options.max_states else 'search limit', None
+    if result.length < options.min_moves:
+        return 'too easy', None
+
+    branching = result.generated / max(result.explored, 1)
+    if not options.min_branching <= branching <= options.max_branching:
+        return 'branching', None
+    return None, {
+        'seed': seed,
+        'tiles': bytes(tiles),
+        'data': data,
+        'moves': result.length,
+        'branching': branching,
+        'explored': result.explored,
+    }
+
+# Returns up to count accepted levels and the number of candidates per outcome.
+# Candidates are graded in seed order, so the same arguments always give the same levels.
+def generate_levels(count: int, options: GeneratorOptions, seed=0, workers=None, max_candidates=GENERATOR_MAX_CANDIDATES):
+    accepted = []
+    outcomes = Counter()
+    chunksize = max(1, GENERATOR_BATCH // (4 * (workers or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(workers) as executor:
+        while len(accepted) < count and outcomes.total() < max_candidates:
+            first = seed + outcomes.total()
+            seeds = range(first, first + min(GENERATOR_BATCH, max_candidates - outcomes.total()))
+            for rejected, entry in executor.map(evaluate_candidate, seeds, repeat(options), chunksize=chunksize):
+                outcomes[rejected or 'accepted'] += 1
+                if entry:
+                    accepted.append(entry)
+                    if len(accepted) == count:
+                        break
+    return accepted, outcomes
+
+# The pack ends on a level without a goal, like the game's own levels
+def end_level():
+    tiles = bytearray([TILE_START, TILE_FLOOR, TILE_FLOOR])
+    data = {'die_layout': [0]*6, 'background': 'stars', 'music': ['pink'], 'texts': [
+        {'text': 'END OF THE PACK', 'pos': [-30, -30], 'delay': 6, 'follow_camera': False},
+    ]}
+    return 3, 1, tiles, data
+
+def save_level_image(filename: str, width: int, height: int, tiles):
+    import pygame
+    colors = {tile: bytes(color) for color, tile in TILE_COLORS.items()}
+    colors[TILE_NONE] = bytes(3)
+    pixels = b''.join(map(colors.__getitem__, tiles))
+    pygame.image.save(pygame.image.frombytes(pixels, (width, height), 'RGB'), filename)
+
+def write_levels(directory: str, entries: list, width: int, height: int):
+    os.makedirs(directory, exist_ok=True)
+    levels = [(width, height, entry['tiles'], entry['data']) for entry in entries] + [end_level()]
+    for lvl, (w, h, tiles, data) in enumerate(levels):
+        save_level_image(f'{directory}/{lvl}.png', w, h, tiles)
+    with open(f'{directory}/dat.json', 'w') as f:
+        json.dump([data for w, h, tiles, data in levels], f, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate solver-graded levels over all cores.')
+    parser.add_argument('output', help='directory to write dat.json and the level images to')
+    parser.add_argument('-n', '--count', type=int, default=10, help='levels to generate')
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--height', type=int, default=10)
+    parser.add_argument('--max-face', type=int, default=2, help='highest die face, 0 to 5')
+    parser.add_argument('--min-moves', type=int, default=8, help='shortest optimal solution to keep')
+    parser.add_argument('--max-moves', type=int, default=20, help='longest optimal solution to keep')
+    parser.add_argument('--min-branching', type=float, default=0.0, help='fewest states reached per state explored')
+    parser.add_argument('--max-branching', type=float, default=4.0, help='most states reached per state explored')
+    parser.add_argument('--max-states', type=int, default=GENERATOR_MAX_STATES, help='reject candidates needing a bigger search')
+    parser.add_argument('--frames-per-move', type=int, default=FRAMES_PER_MOVE, help='frames assumed between two moves')
+    parser.add_argument('--max-candidates', type=int, default=GENERATOR_MAX_CANDIDATES, help='give up after grading this many candidates')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first candidate')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    args = parser.parse_args()
+    if not 0 <= args.max_face < DIE_FACES:
+        parser.error('--max-face must be between 0 and 5')
+
+    options = GeneratorOptions(
+        args.width, args.height, args.max_face,
+        args.min_moves, args.max_moves, args.min_branching, args.max_branching,
+        args.max_states, args.frames_per_move,
+    )
+    start_time = time.perf_counter()
+    entries, outcomes = generate_levels(args.count, options, args.seed, args.workers, args.max_candidates)
+    write_levels(args.output, entries, args.width, args.height)
+
+    json.dump({
+        'levels': len(entries),
+        'candidates': outcomes.total(),
+        'outcomes': dict(outcomes),
+        'time': time.perf_counter() - start_time,
+        'generated': [{key: entry[key] for key in ('seed', 'moves', 'branching', 'explored')} for entry in entries],
+    }, sys.stdout, indent=4)
+    print()
+    sys.exit(0 if len(entries) == args.count else 1)
@@ -1,163 +1,97 @@
 import pygame
-from pygame.math import Vector2 as vec2, Vector3 as vec3
+from pygame.math import Vector2 as vec2
 
-from math import floor, sin, copysign
+from math import floor, ceil
+from collections import OrderedDict
+from operator import itemgetter
 
 from constants import *
+from simulation import *
 from spritesheet import spritesheet
+from particles import ParticlePool
+from text import GLYPH_ADVANCE, GLYPH_HEIGHT
 
 
 ISO_X_OFFSET = 11
 ISO_Y_OFFSET = 5
 ISO_ELEMENT_PROJECTED_WIDTH = 23
 ISO_ELEMENT_PROJECTED_HEIGHT = 22
+ISO_CHUNK_SIZE = 128 # Size in pixels of the pre-rendered static layer chunks
+ISO_CHUNK_CACHE = 64 # Maximum number of baked chunks kept around
 
+# Something placed on the grid, at integer grid coordinates
 class Iso:
-    def __init__(self, position: vec3):
-        self.position = position
+    __slots__ = ('x', 'y', 'z')
+
+    def __init__(self, x=0, y=0, z=0):
+        self.x = x
+        self.y = y
+        self.z = z
+    
+    def grid_position(self) -> tuple:
+        return (self.x, self.y, self.z)
     
-    def project_coord(self, coord: vec3) -> vec2:
+    def project(self) -> vec2:
         return vec2(
-                (coord.x - coord.y) * ISO_X_OFFSET,
-                (coord.x + coord.y - coord.z) * ISO_Y_OFFSET
+                (self.x - self.y) * ISO_X_OFFSET,
+                (self.x + self.y - self.z) * ISO_Y_OFFSET
             )
-    def project(self) -> vec2:
-        return self.project_coord(self.position)
-
-
-class IsoParticle(Iso):
-    def __init__(self, position: vec3, velocity: vec3, lifetime: int):
-        super().__init__(position)
-        self.velocity = velocity
-        self.lifetime = lifetime
-        self.dead = False
     
-    def update(self):
-        if not self.dead:
-            self.position += self.velocity
-            self.lifetime -= 1
-            if not self.lifetime:
-                self.dead = True
-
-
-class IsoTextParticle(IsoParticle):
-    def __init__(self, text: str, position: vec3, velocity: vec3, lifetime: int):
-        super().__init__(position, velocity, lifetime)
-        self.text = text
+    # Sort key for drawing, elements with a higher depth are drawn on top
+    def depth(self) -> int:
+        return (self.x + self.y) * ISO_Y_OFFSET
+    
+    # Area covered by the element's sprite in projected coordinates
+    def bounds(self) -> pygame.Rect:
+        return pygame.Rect(self.project(), (ISO_ELEMENT_PROJECTED_WIDTH, ISO_ELEMENT_PROJECTED_HEIGHT))
 
 
 class IsoCamera(Iso):
+    __slots__ = ('rect', 'previous', 'current', 'gm')
+
     def __init__(self, gm, rect: pygame.Rect):
-        super().__init__(vec3(rect.x, rect.y, 0))
-        self.rect = rect
+        super().__init__(rect.x, rect.y, 0)
+        self.rect = rect # The view that is drawn, between the two last simulated views
+        self.previous = rect.copy()
+        self.current = rect.copy()
         self.gm = gm
 
     
     # Checks if an element is in view to prevent unecessary draw instructions
     def in_view(self, element: Iso) -> bool:
-        return self.rect.colliderect(
-            pygame.Rect(
-                element.project(),
-                (ISO_ELEMENT_PROJECTED_WIDTH, ISO_ELEMENT_PROJECTED_HEIGHT)
-            )
-        )
+        return self.rect.colliderect(element.bounds())
     
     def update(self):
         die_pos = self.gm.die.project()
 
-        self.rect.centerx += ( die_pos.x - self.rect.centerx ) / 10
-        self.rect.centery += ( die_pos.y - self.rect.centery ) / 10
-
-class IsoBlock(Iso):
-    def __init__(self, position: vec3, ID: int):
-        super().__init__(position)
-        self.ID = ID
-    
-
-class IsoTimedBlock(IsoBlock):
-    def __init__(self, gm, position, ID, time=60):
-        super().__init__(position, ID)
-        self.gm = gm
-        self.time = time
-        self.tick = time
-        self.stepped_on = False
-    
-    
-    def update(self):
-        if self.ID == 4 and self.stepped_on:
-            self.tick -= 1
-            if not self.tick:
-                self.ID = 5 # Become void block
-                self.stepped_on = False
-                self.gm.sounds['blip'].play()
-        
-        elif self.ID == 5:
-            self.tick += 1
-            if self.tick == self.time:
-                self.ID = 4 # Become timer block
-                self.gm.sounds['blip'].play()
-
-class DieLayout:
-    def __init__(self, top, bottom, right, left, front, back):
-        self.top = top
-        self.bottom = bottom
-        self.right = right
-        self.left = left
-        self.front = front
-        self.back = back
+        self.previous = self.current.copy()
+        self.current.centerx += ( die_pos.x - self.current.centerx ) / 10
+        self.current.centery += ( die_pos.y - self.current.centery ) / 10
     
-    def __repr__(self):
-        return f'DieLayout(top: {self.top}, bottom: {self.bottom}, right: {self.right}, left: {self.left}, front: {self.front}, back: {self.back})'
-
-    def copy(self, existing):
-        return DieLayout(existing.top, existing.bottom, existing.right, existing.left, existing.front, existing.back)
-    
-    def fromlist(l):
-        return DieLayout(l[0],l[1],l[2],l[3],l[4],l[5])
-    
-    def roll_front(self):
-        old = self.copy(self)
-        self.top = old.back
-        self.back = old.bottom
-        self.bottom = old.front
-        self.front = old.top
-    def roll_back(self):
-        old = self.copy(self)
-        self.top = old.front
-        self.back = old.top
-        self.bottom = old.back
-        self.front = old.bottom
-    def roll_right(self):
-        old = self.copy(self)
-        self.top = old.left
-        self.left = old.bottom
-        self.bottom = old.right
-        self.right = old.top
-    def roll_left(self):
-        old = self.copy(self)
-        self.top = old.right
-        self.left = old.top
-        self.bottom = old.left
-        self.right = old.bottom
+    # Places the drawn view alpha of the way from the previous to the current update
+    def interpolate(self, alpha: float):
+        self.rect.center = (
+            round(self.previous.centerx + (self.current.centerx - self.previous.centerx) * alpha),
+            round(self.previous.centery + (self.current.centery - self.previous.centery) * alpha),
+        )
 
 class IsoDie(Iso):
-    def __init__(self, gm, position: vec3, layout: DieLayout):
-        super().__init__(position)
-        self.gm = gm
-        self.default_position = position.copy()
-        self.sample_offset = vec3(-1,0,-1)
-        self.layout = layout
+    __slots__ = ('gm', 'layout', 'sampler', 'faces', 'textures', 'tex')
 
+    def __init__(self, gm):
+        super().__init__()
+        self.gm = gm
+        self.layout = DieLayout(0,0,0,0,0,0)
 
         ss = spritesheet('img/die.png')
 
         self.sampler = ss.image_at([0,0,9,9])
-        self.tex = ss.image_at([0,0,9,9],(0,0,0))
 
         self.faces = ss.images_at([
             [0, 9,3,3], [3, 9,3,3], [6, 9,3,3],
             [0,12,3,3], [3,12,3,3], [6,12,3,3],
         ])
+        self.textures = self._bake_textures(ss.image_at([0,0,9,9],(0,0,0)))
         self.update_tex()
     
     def _sample_uv(self, value: int, sampled: pygame.Surface):
@@ -165,103 +99,114 @@ class IsoDie(Iso):
         uv = ( q % 3, floor(q/3) )
         return sampled.get_at(uv)
     
-    def update_tex(self):
+    def _shade(self, color, amount):
+        return (max(color.r-amount, 1), max(color.g-amount, 1), max(color.b-amount, 1), 255)
+    
+    # Builds the texture of every (front, top, right) face combination so rolling never touches pixels
+    def _bake_textures(self, base: pygame.Surface) -> dict:
+        front_layers = [pygame.Surface(base.get_size(), pygame.SRCALPHA) for face in self.faces]
+        top_layers = [pygame.Surface(base.get_size(), pygame.SRCALPHA) for face in self.faces]
+        right_layers = [pygame.Surface(base.get_size(), pygame.SRCALPHA) for face in self.faces]
+
         for j in range(9):
             for i in range(9):
                 sample = self.sampler.get_at((i,j))
                 if sample != (0,0,0) and sample != (237,237,228):
-                    if sample.r:
-                        color = self._sample_uv(sample.r, self.faces[self.layout.front])
-                        self.tex.set_at((i,j), (max(color.r-10, 1), max(color.g-10, 1), max(color.b-10, 1), 255))
-                    elif sample.g: self.tex.set_at((i,j), self._sample_uv(sample.g, self.faces[self.layout.top]))
-                    elif sample.b:
-                        color = self._sample_uv(sample.b, self.faces[self.layout.right])
-                        self.tex.set_at((i,j), (max(color.r-50, 1), max(color.g-50, 1), max(color.b-50, 1), 255))
-    
-    def _check_collision(self, sample: vec3, isos):
-        for iso in isos:
-            if isinstance(iso, IsoBlock) and iso.position == sample:
-                return iso
-        return None
-    
-    def _move_process(self, iso):
-        if iso == None or iso.ID == 5: # Void tiles
-            self.gm.sounds['invalid'].play()
-            return False
-        elif iso.ID == 4: # White tile
-            iso.stepped_on = True
-        elif iso.ID == 3: # Red tile
-            self.gm.load(self.gm.lvl_id+1)
-            if self.gm.lvl_id:
-                self.gm.sounds['win'].play()
+                    for face, front, top, right in zip(self.faces, front_layers, top_layers, right_layers):
+                        if sample.r: front.set_at((i,j), self._shade(self._sample_uv(sample.r, face), 10))
+                        elif sample.g: top.set_at((i,j), self._sample_uv(sample.g, face))
+                        elif sample.b: right.set_at((i,j), self._shade(self._sample_uv(sample.b, face), 50))
         
-        return True
+        textures = {}
+        for f, front in enumerate(front_layers):
+            for t, top in enumerate(top_layers):
+                for r, right in enumerate(right_layers):
+                    tex = base.copy()
+                    tex.blit(front, (0,0))
+                    tex.blit(top, (0,0))
+                    tex.blit(right, (0,0))
+                    textures[(f, t, r)] = tex
+        return textures
     
-    def _move_complete(self, dice_number):
-        self.update_tex()
-        self.gm.sounds['step'].play()
-        self.gm.isometric.isos.append(IsoTextParticle(f'{dice_number}', self.position.copy(), vec3(.01,0,.2), 20))
-
-    def move_x(self, dx, isos):
-        sample = self.position + self.sample_offset
-        step = copysign(1, dx)
-        for s in range(abs(dx)):
-            sample.x += step
-            step_collision = self._check_collision(sample, isos)
-            if step_collision and step_collision.ID == 1:
-                self.gm.sounds['invalid'].play()
-                return False
-        
-        end_collision = self._check_collision(sample, isos)
-        if not self._move_process(end_collision):
-            return False
-        
-        self.position.x += dx
-
-        self._move_complete(abs(dx))
-        return True
-
+    def update_tex(self):
+        self.tex = self.textures[(self.layout.front, self.layout.top, self.layout.right)]
     
-    def move_y(self, dy, isos):
-        sample = self.position + self.sample_offset
-        step = copysign(1, dy)
-        for s in range(abs(dy)):
-            sample.y += step
-            step_collision = self._check_collision(sample, isos)
-            if step_collision and step_collision.ID == 1:
-                self.gm.sounds['invalid'].play()
-                return False
-        
-        end_collision = self._check_collision(sample, isos)
-        if not self._move_process(end_collision):
-            return False
-        
-        self.position.y += dy
+    # Mirrors the die of a simulation state, the die is drawn on top of the tile at its grid position
+    def sync(self, state: GameState):
+        self.x, self.y, self.z = state.x+1, state.y, 1
+        if self.layout is not state.layout:
+            self.layout = state.layout
+            self.update_tex()
 
-        self._move_complete(abs(dy))
-        return True
-    
-    def move_right(self):
-        self.layout.roll_right()
-        if not self.move_x(self.layout.bottom+1, self.gm.isometric.isos): self.layout.roll_left()
-    def move_left(self):
-            self.layout.roll_left()
-            if not self.move_x(-(self.layout.bottom+1), self.gm.isometric.isos): self.layout.roll_right()
-    def move_front(self):
-            self.layout.roll_front()
-            if not self.move_y(self.layout.bottom+1, self.gm.isometric.isos): self.layout.roll_back()
-    def move_back(self):
-            self.layout.roll_back()
-            if not self.move_y(-(self.layout.bottom+1), self.gm.isometric.isos): self.layout.roll_front()
-    
-    def update(self):
-        if self._check_collision(self.position+self.sample_offset, self.gm.isometric.isos).ID == 5:
-            self.gm.reset('invalid')
+    def bounds(self) -> pygame.Rect:
+        return pygame.Rect(self.project() + vec2(-4,3), self.tex.get_size())
 
     def draw(self):
         self.gm.screen.blit(self.tex, self.project() - self.gm.camera.rect.topleft + vec2(-4,3))
 
+
+# Blocks baked into cached chunk surfaces so a frame only needs a handful of blits.
+# Only the chunks around the camera are kept, so a level of any size costs the same memory.
+class IsoStaticLayer:
+    def __init__(self, isometric):
+        self.isometric = isometric
+        self.chunks = OrderedDict()
+    
+    def clear(self):
+        self.chunks.clear()
+    
+    def _chunk_rect(self, key) -> pygame.Rect:
+        return pygame.Rect(key[0]*ISO_CHUNK_SIZE, key[1]*ISO_CHUNK_SIZE, ISO_CHUNK_SIZE, ISO_CHUNK_SIZE)
+    
+    def _chunk_keys(self, rect: pygame.Rect):
+        for cy in range(floor(rect.top/ISO_CHUNK_SIZE), floor((rect.bottom-1)/ISO_CHUNK_SIZE)+1):
+            for cx in range(floor(rect.left/ISO_CHUNK_SIZE), floor((rect.right-1)/ISO_CHUNK_SIZE)+1):
+                yield (cx, cy)
+    
+    # Draws every block overlapping area (in projected coordinates) onto surf, whose origin is at offset
+    def _render(self, surf: pygame.Surface, area: pygame.Rect, offset):
+        surf.set_clip(area.move(-offset[0], -offset[1]))
+        surf.fill((0,0,0))
+        textures = self.isometric.block_textures
+        for x, y, ID in self.isometric.blocks_in_rect(area):
+            surf.blit(textures[ID], ((x - y)*ISO_X_OFFSET - offset[0], (x + y)*ISO_Y_OFFSET - offset[1]))
+        surf.set_clip(None)
     
+    def _bake(self, key):
+        rect = self._chunk_rect(key)
+        surf = pygame.Surface(rect.size).convert()
+        surf.set_colorkey((0,0,0))
+        self._render(surf, rect, rect.topleft)
+        return surf
+    
+    def _get_chunk(self, key):
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+        else:
+            self.chunks[key] = self._bake(key)
+            if len(self.chunks) > ISO_CHUNK_CACHE:
+                self.chunks.popitem(last=False)
+        return self.chunks[key]
+    
+    # Redraws the part of the baked chunks covered by area after a block changed
+    def invalidate(self, area: pygame.Rect):
+        for key in self._chunk_keys(area):
+            if key in self.chunks:
+                rect = self._chunk_rect(key)
+                self._render(self.chunks[key], area.clip(rect), rect.topleft)
+    
+    # Bakes one chunk near the view ahead of time, meant to be called once per update so
+    # the chunks the camera moves into are usually ready before they are drawn
+    def poll(self, camera: pygame.Rect):
+        for key in self._chunk_keys(camera.inflate(ISO_CHUNK_SIZE, ISO_CHUNK_SIZE)):
+            if key not in self.chunks:
+                self._get_chunk(key)
+                return
+    
+    def draw(self, surf: pygame.Surface, camera: pygame.Rect):
+        for key in self._chunk_keys(camera):
+            surf.blit(self._get_chunk(key), self._chunk_rect(key).topleft - vec2(camera.topleft))
+
 
 class Isometric:
     def __init__(self, gm):
@@ -278,54 +223,119 @@ class Isometric:
             ],
             (0,0,0)
         )
-        self.size: vec2
+        self.level = None # Blocks are read straight from the level's tiles, no object is made per block
+        self.isos = [] # Elements drawn on top of the static layer (the die), kept in depth order
+        self.particles = ParticlePool(3) # Text particles, also drawn on top of the static layer
+        self.gone = frozenset() # Slots of the timed blocks drawn as gone
+        self.static_layer = IsoStaticLayer(self)
+
+    # Area covered by the block at a grid position, in projected coordinates
+    def block_bounds(self, x: int, y: int) -> pygame.Rect:
+        return pygame.Rect((x - y)*ISO_X_OFFSET, (x + y)*ISO_Y_OFFSET, ISO_ELEMENT_PROJECTED_WIDTH, ISO_ELEMENT_PROJECTED_HEIGHT)
+
+    # Yields (x, y, ID) for the ground level blocks whose sprite overlaps rect (in projected coordinates), in draw order.
+    # The projection is inverted so only the grid cells in the matching band are visited, whatever the level size.
+    def blocks_in_rect(self, rect: pygame.Rect):
+        level = self.level
+        width, height = level.width, level.height
+        cells, rows, columns = level.cells()
+        u_min = floor((rect.left - ISO_ELEMENT_PROJECTED_WIDTH) / ISO_X_OFFSET) + 1
+        u_max = ceil(rect.right / ISO_X_OFFSET) - 1
+        v_min = max(floor((rect.top - ISO_ELEMENT_PROJECTED_HEIGHT) / ISO_Y_OFFSET) + 1, 0)
+        v_max = min(ceil(rect.bottom / ISO_Y_OFFSET) - 1, width + height - 2)
+        for v in range(v_min, v_max+1):
+            # u = x - y and v = x + y, u is clamped so x and y stay inside the level
+            first = min(u_max, v, 2*(width-1) - v)
+            last = max(u_min, -v, v - 2*(height-1))
+            # Same depth rows are drawn in the order they were loaded (rows top to bottom)
+            for u in range(first - ((first + v) & 1), last-1, -2):
+                x = (u + v) // 2
+                y = (v - u) // 2
+                ID = cells[rows[y] + columns[x]]
+                if ID == TILE_NONE:
+                    continue
+                if ID == TILE_TIMED and level.timed_slot(y*width + x) in self.gone:
+                    ID = TILE_VOID
+                yield x, y, ID
+
+    def load(self, level: Level):
         self.isos = []
+        self.particles.clear()
+        self.level = level
+        self.gone = frozenset()
+        self.static_layer.clear()
+        if level.start:
+            self.isos.append(self.gm.die)
     
-    def load(self, image_filename: str):
-        self.isos = []
-        im = pygame.image.load(image_filename)
-        self.size = vec2(im.get_size())
-        for j in range(im.get_height()):
-            for i in range(im.get_width()):
-                color = im.get_at((i,j))
-                if color == (0,0,0xFF): self.isos.append(IsoBlock(vec3(i,j,0), 0))
-                elif color == (0xFF,0x7F,0): self.isos.append(IsoBlock(vec3(i,j,0), 1))
-                elif color == (0xFF,0,0): self.isos.append(IsoBlock(vec3(i,j,0), 3))
-                elif color == (0,0xFF,0):
-                    self.isos.append(IsoBlock(vec3(i,j,0), 2))
-                    # Regular die layout DieLayout(0,5,1,4,2,3)
-                    self.gm.die = IsoDie(self.gm, vec3(i+1,j,1), DieLayout(0,0,0,0,0,0))
-                    self.isos.append(self.gm.die)
-                elif color == (0x64,0x64,0x64):
-                    self.isos.append(IsoTimedBlock(self.gm, vec3(i,j,0), 4))
-
+    # Mirrors the die and the timed tiles of a simulation state, only the tiles that changed are visited
+    def sync(self, state: GameState):
+        self.gm.die.sync(state)
+        if state.gone is not self.gone:
+            changed = state.gone ^ self.gone
+            self.gone = state.gone
+            for slot in changed:
+                index = self.level.timed[slot]
+                self.static_layer.invalidate(self.block_bounds(index % self.level.width, index // self.level.width))
+
+    def spawn_text(self, text: str, position: tuple):
+        self.particles.spawn(position, (.01, 0, .2), 20, text)
 
     def update(self):
-        sort_expr = lambda x: (x.project().y + x.position.z * ISO_Y_OFFSET)
-        self.isos.sort(key=sort_expr)
-        deadIsos = []
-        for iso in self.isos:
-            if isinstance(iso, IsoTimedBlock) or isinstance(iso, IsoDie):
-                iso.update()
-            if isinstance(iso, IsoParticle):
-                iso.update()
-                if iso.dead:
-                    deadIsos.append(iso)
-        
-        for iso in deadIsos:
-            self.isos.remove(iso)
+        # Blocks are ordered by the static layer, only the few moving elements are sorted here
+        self.isos.sort(key=Iso.depth)
+        self.particles.update()
+        self.static_layer.poll(self.gm.camera.current)
     
-    def draw(self):
+    # Redraws the blocks in front of a dynamic element, clipped to the element, so depth stays correct
+    def _draw_occluders(self, bounds: pygame.Rect, depth: float):
+        ox, oy = self.gm.camera.rect.topleft
+        self.gm.screen.set_clip(bounds.move(-ox, -oy))
+        for x, y, ID in self.blocks_in_rect(bounds):
+            if (x + y)*ISO_Y_OFFSET > depth:
+                self.gm.screen.blit(self.block_textures[ID], ((x - y)*ISO_X_OFFSET - ox, (x + y)*ISO_Y_OFFSET - oy))
+        self.gm.screen.set_clip(None)
+    
+    def _particle_depth(self, i: int) -> float:
+        return (self.particles.positions[0][i] + self.particles.positions[1][i]) * ISO_Y_OFFSET
+    
+    def _particle_position(self, i: int, alpha: float) -> vec2:
+        x, y, z = self.particles.position(i, alpha)
+        return vec2((x - y) * ISO_X_OFFSET, (x + y - z) * ISO_Y_OFFSET)
+    
+    # Area covered by a particle's text, in projected coordinates
+    def _particle_bounds(self, i: int, position: vec2) -> pygame.Rect:
+        return pygame.Rect(position, (len(self.particles.data[i])*GLYPH_ADVANCE, GLYPH_HEIGHT))
+    
+    def _draw_particle(self, i: int, position: vec2, bounds: pygame.Rect):
+        self.gm.text_manager.blit(self.particles.data[i], position - self.gm.camera.rect.topleft)
+        self._draw_occluders(bounds, self._particle_depth(i))
+    
+    # alpha is how far rendering is between the last two updates, particles are drawn in between
+    def draw(self, alpha=1.0):
+        self.static_layer.draw(self.gm.screen, self.gm.camera.rect)
+
+        # Only what overlaps the view is kept: the blocks come from a range query of the tiles
+        # (static layer chunks and occluders), the few dynamic elements are tested one by one
+        camera = self.gm.camera.rect
+        particles = []
+        for i in range(len(self.particles)):
+            position = self._particle_position(i, alpha)
+            bounds = self._particle_bounds(i, position)
+            if camera.colliderect(bounds):
+                particles.append((self._particle_depth(i), i, position, bounds))
+        particles.sort(key=itemgetter(0))
+
+        # The elements and particles are merged by depth and drawn on top of the static layer
+        p = 0
         for iso in self.isos:
+            depth = iso.depth()
+            while p < len(particles) and particles[p][0] < depth:
+                self._draw_particle(*particles[p][1:])
+                p += 1
+            
             if self.gm.camera.in_view(iso):
-                surf: pygame.Surface = None
-                if isinstance(iso, IsoBlock):
-                    self.gm.screen.blit(self.block_textures[iso.ID], iso.project() - self.gm.camera.rect.topleft)
-
-                if isinstance(iso, IsoDie):
-                    iso.draw()
-                
-                if isinstance(iso, IsoTextParticle):
-                    self.gm.text_manager.blit(iso.text, iso.project() - self.gm.camera.rect.topleft)
-                
-        
\ No newline at end of file
+                iso.draw()
+                self._draw_occluders(iso.bounds(), depth)
+        
+        for depth, i, position, bounds in particles[p:]:
+            self._draw_particle(i, position, bounds)
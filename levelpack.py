@@ -0,0 +1,253 @@
+# Packs a level directory into one file the game reads levels from in place, nothing is parsed or decoded.
+#   python levelpack.py [DIRECTORY] [OUTPUT]      levels into levels.pack by default, checked against the directory after
+#
+# Layout, every number is little endian and every section starts on a multiple of 4:
+#   header   magic, version, level count, string count, offset of the string table
+#   index    one PACK_LEVEL record per level, right after the header
+#   strings  string count+1 offsets followed by the utf-8 bytes of every distinct background, music and text
+#   levels   per level its tile chunks, timed tile indices and music string IDs (u32 each) and PACK_TEXT records
+#   chunks   blocks of PACK_CHUNK_SIZE by PACK_CHUNK_SIZE tiles (a byte each, TILE_NONE past the level's edges)
+#            row by row, all the same size so a tile's place is worked out from its position
+# Opening a pack only reads the header, a level is read through its index record when it is asked for.
+# Nothing of a level is copied, its tiles are read from the chunks in place so only the pages of the
+# chunks around the die and the camera are ever read from the file, whatever the size of the level.
+
+import os
+import sys
+import time
+import struct
+import argparse
+from array import array
+
+try:
+    import mmap
+except ImportError: # Not every platform has it, the pack is read into memory instead
+    mmap = None
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from simulation import *
+
+
+PACK_MAGIC = b'DICEPACK'
+PACK_VERSION = 3
+PACK_HEADER = struct.Struct('<8sHxxIII')
+PACK_LEVEL = struct.Struct('<II6sxxIiIIIIIII') # width, height, die layout, background, start, chunks, timed, timed count, music, music count, texts, texts count
+PACK_TEXT = struct.Struct('<IiiI?xxx') # text, x, y, delay, follow camera
+PACK_NATIVE = sys.byteorder == 'little' # u32 arrays can be viewed as they are
+PACK_CHUNK_BITS = 6
+PACK_CHUNK_SIZE = 1 << PACK_CHUNK_BITS # Width and height in tiles of a chunk
+PACK_CHUNK_MASK = PACK_CHUNK_SIZE - 1
+PACK_CHUNK_AREA_BITS = 2*PACK_CHUNK_BITS # A chunk is 1 << PACK_CHUNK_AREA_BITS tiles, 4KB
+
+
+# A level's tiles indexed row major like a bytearray, read in place from the pack's chunks
+class ChunkedTiles:
+    def __init__(self, view: memoryview, width: int, height: int):
+        self.view = view # The level's chunks, one after the other
+        self.width = width
+        self.height = height
+        self.size = width*height
+        self.chunk_columns = -(-width // PACK_CHUNK_SIZE)
+        self.offsets = None # (rows, columns) for cells
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index: int) -> int:
+        if not 0 <= index < self.size:
+            raise IndexError('tile index out of range')
+        y, x = divmod(index, self.width)
+        return self.view[((y >> PACK_CHUNK_BITS)*self.chunk_columns + (x >> PACK_CHUNK_BITS)) << PACK_CHUNK_AREA_BITS | (y & PACK_CHUNK_MASK) << PACK_CHUNK_BITS | x & PACK_CHUNK_MASK]
+
+    # The view with the offsets of the rows and columns in it, view[rows[y] + columns[x]] is the tile
+    # at x, y without going through __getitem__. Worked out the first time they are asked for.
+    def cells(self) -> tuple:
+        if self.offsets is None:
+            rows = array('I', (((y >> PACK_CHUNK_BITS)*self.chunk_columns << PACK_CHUNK_AREA_BITS) | (y & PACK_CHUNK_MASK) << PACK_CHUNK_BITS for y in range(self.height)))
+            columns = array('I', ((x >> PACK_CHUNK_BITS) << PACK_CHUNK_AREA_BITS | x & PACK_CHUNK_MASK for x in range(self.width)))
+            self.offsets = (rows, columns)
+        return (self.view, *self.offsets)
+
+    # Every tile row major, a copy for code that reads all of them many times over
+    def __bytes__(self):
+        tiles = bytearray()
+        for y in range(self.height):
+            first = ((y >> PACK_CHUNK_BITS)*self.chunk_columns << PACK_CHUNK_AREA_BITS) + ((y & PACK_CHUNK_MASK) << PACK_CHUNK_BITS)
+            for column in range(self.chunk_columns):
+                start = first + (column << PACK_CHUNK_AREA_BITS)
+                tiles += self.view[start:start + min(PACK_CHUNK_SIZE, self.width - (column << PACK_CHUNK_BITS))]
+        return bytes(tiles)
+
+
+class LevelPack:
+    def __init__(self, filename: str):
+        with open(filename, 'rb') as f:
+            try:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                self.buffer = f.read()
+        self.view = memoryview(self.buffer)
+        magic, version, self.count, string_count, strings = PACK_HEADER.unpack_from(self.buffer)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            raise ValueError(f'{filename} is not a version {PACK_VERSION} level pack')
+        self.string_offsets = self._u32s(strings, string_count+1)
+        self.strings = {} # Decoded on first use
+
+    def __len__(self):
+        return self.count
+
+    def _u32s(self, offset: int, count: int):
+        view = self.view[offset:offset + count*4].cast('I')
+        if PACK_NATIVE:
+            return view
+        values = array('I', view.tobytes())
+        values.byteswap()
+        return values
+
+    def string(self, i: int) -> str:
+        string = self.strings.get(i)
+        if string is None:
+            string = self.strings[i] = str(self.view[self.string_offsets[i]:self.string_offsets[i+1]], 'utf-8')
+        return string
+
+    def _record(self, lvl: int) -> tuple:
+        if not 0 <= lvl < self.count:
+            raise IndexError(f'level {lvl} is not in the pack')
+        return PACK_LEVEL.unpack_from(self.buffer, PACK_HEADER.size + lvl*PACK_LEVEL.size)
+
+    # The level's entry as it is in dat.json
+    def data(self, lvl: int) -> dict:
+        return self._data(self._record(lvl))
+
+    def _data(self, record: tuple) -> dict:
+        width, height, layout, background, start, tiles, timed, timed_count, music, music_count, texts, texts_count = record
+        return {
+            'die_layout': list(layout),
+            'background': self.string(background),
+            'music': [self.string(i) for i in self._u32s(music, music_count)],
+            'texts': [
+                {'text': self.string(text), 'pos': [x, y], 'delay': delay, 'follow_camera': follow_camera}
+                for text, x, y, delay, follow_camera in PACK_TEXT.iter_unpack(self.view[texts:texts + texts_count*PACK_TEXT.size])
+            ],
+        }
+
+    # The tiles and timed tile indices are views into the pack, not copies
+    def level(self, lvl: int) -> Level:
+        record = self._record(lvl)
+        width, height, layout, background, start, chunks, timed, timed_count = record[:8]
+        chunk_count = -(-width // PACK_CHUNK_SIZE) * -(-height // PACK_CHUNK_SIZE)
+        tiles = ChunkedTiles(self.view[chunks:chunks + (chunk_count << PACK_CHUNK_AREA_BITS)], width, height)
+        return Level(width, height, tiles, self._data(record), start, self._u32s(timed, timed_count))
+
+
+# Whether filename is a pack this version of the game reads, an older one has to be written again
+def is_current_pack(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        header = f.read(PACK_HEADER.size)
+    return len(header) == PACK_HEADER.size and PACK_HEADER.unpack(header)[:2] == (PACK_MAGIC, PACK_VERSION)
+
+
+def _align(out: bytearray):
+    out += bytes(-len(out) % 4)
+
+def _u32s(values) -> bytes:
+    values = array('I', values)
+    if not PACK_NATIVE:
+        values.byteswap()
+    return values.tobytes()
+
+# A level's tiles as they are laid out in its chunk section
+def _chunks(width: int, height: int, tiles) -> bytes:
+    chunks = bytearray()
+    for top in range(0, height, PACK_CHUNK_SIZE):
+        for left in range(0, width, PACK_CHUNK_SIZE):
+            chunk = bytearray([TILE_NONE])*(1 << PACK_CHUNK_AREA_BITS)
+            right = min(left + PACK_CHUNK_SIZE, width)
+            for y in range(top, min(top + PACK_CHUNK_SIZE, height)):
+                start = (y - top) << PACK_CHUNK_BITS
+                chunk[start:start + right - left] = tiles[y*width + left:y*width + right]
+            chunks += chunk
+    return bytes(chunks)
+
+# Writes (width, height, tiles, data) levels as a pack
+def write_pack(filename: str, levels: list):
+    strings = {} # ID by string, in order of first use
+    intern = lambda string: strings.setdefault(string, len(strings))
+    out = bytearray(PACK_HEADER.size + len(levels)*PACK_LEVEL.size)
+    records = []
+    for width, height, tiles, data in levels:
+        level = Level(width, height, tiles, data)
+        start = level.start[1]*width + level.start[0] if level.start else -1
+        offsets = []
+        for section in (
+            _chunks(width, height, tiles),
+            _u32s(level.timed),
+            _u32s(map(intern, data['music'])),
+            b''.join(PACK_TEXT.pack(intern(t['text']), *t['pos'], t['delay'], t['follow_camera']) for t in data['texts']),
+        ):
+            offsets.append(len(out))
+            out += section
+            _align(out)
+        chunks_at, timed_at, music_at, texts_at = offsets
+        records.append((
+            width, height, bytes(data['die_layout']), intern(data['background']), start,
+            chunks_at, timed_at, len(level.timed), music_at, len(data['music']), texts_at, len(data['texts']),
+        ))
+
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = [len(out) + (len(encoded)+1)*4]
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+    strings_offset = len(out)
+    out += _u32s(offsets)
+    out += b''.join(encoded)
+    _align(out)
+
+    PACK_HEADER.pack_into(out, 0, PACK_MAGIC, PACK_VERSION, len(levels), len(encoded), strings_offset)
+    for lvl, record in enumerate(records):
+        PACK_LEVEL.pack_into(out, PACK_HEADER.size + lvl*PACK_LEVEL.size, *record)
+    with open(filename, 'wb') as f:
+        f.write(out)
+
+def pack_directory(directory=LEVELS_DIRECTORY, filename=LEVEL_PACK):
+    data = load_level_data(directory)
+    write_pack(filename, [(*decode_level_image(f'{directory}/{lvl}.png'), entry) for lvl, entry in enumerate(data)])
+
+# Levels whose tiles, start, timed tiles or data differ between the pack and the directory
+def compare_pack(filename=LEVEL_PACK, directory=LEVELS_DIRECTORY) -> list:
+    pack = LevelPack(filename)
+    data = load_level_data(directory)
+    if len(pack) != len(data):
+        return list(range(min(len(pack), len(data)), max(len(pack), len(data))))
+    differ = []
+    for lvl in range(len(pack)):
+        packed, level = pack.level(lvl), load_level(lvl, directory)
+        if (
+            (packed.width, packed.height, bytes(packed.tiles), packed.start, list(packed.timed)) !=
+            (level.width, level.height, bytes(level.tiles), level.start, list(level.timed)) or pack.data(lvl) != data[lvl]
+        ):
+            differ.append(lvl)
+    return differ
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Packs a level directory into one file the game can read levels from in place.')
+    parser.add_argument('directory', nargs='?', default=LEVELS_DIRECTORY, help='directory with dat.json and the level images')
+    parser.add_argument('output', nargs='?', default=LEVEL_PACK, help='pack to write')
+    args = parser.parse_args()
+
+    pack_directory(args.directory, args.output)
+    differ = compare_pack(args.output, args.directory)
+
+    start = time.perf_counter()
+    pack = LevelPack(args.output)
+    opened = time.perf_counter()
+    for lvl in range(len(pack)):
+        pack.level(lvl)
+    loaded = time.perf_counter()
+    print(f'{len(pack)} levels, {os.path.getsize(args.output)} bytes written to {args.output}')
+    print(f'Opened in {(opened - start)*1e6:.0f}us, {(loaded - opened) / max(len(pack), 1) * 1e6:.0f}us per level')
+    if differ:
+        print(f'Levels that differ from {args.directory}: {differ}')
+        sys.exit(1)
@@ -1,4 +1,4 @@
-import sys, platform
+import os, sys, platform
 
 mobile = False
 if sys.platform == "emscripten":
@@ -7,17 +7,32 @@ if sys.platform == "emscripten":
     user_agent = js.window.navigator.userAgent
     mobile = any(mobile_str in user_agent for mobile_str in ["Mobi", "Android", "iPhone", "iPad"])
 
-import json
 import asyncio
 import pygame
 from pygame.math import Vector2 as vec2
 
 from constants import *
+from simulation import *
 from text import *
 from isometric import *
 from backgrounds import *
+from profiler import Profiler
+from replay import MoveLog, RECORD_ENV
+from assets import AssetManager
+from present import open_presenter
 
 
+# Sound played for each simulation event
+EVENT_SOUNDS = {
+    EVENT_MOVE: 'step',
+    EVENT_BLOCKED: 'invalid',
+    EVENT_GOAL: 'win',
+    EVENT_VANISH: 'blip',
+    EVENT_RESTORE: 'blip',
+    EVENT_FALL: 'invalid',
+    EVENT_RESET: 'reset',
+}
+
 # Initialize pygame
 pygame.init()
 pygame.mixer.init()
@@ -27,9 +42,9 @@ class DiceGame:
     def __init__(self):
         pygame.display.set_caption('Totally Orginal Dice Game')
 
-        # Declare window display surface and screen surface
-        self.window = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
-        self.screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        # Everything is drawn on the screen, the presenter puts it on the window (see present.py)
+        self.presenter = open_presenter()
+        self.screen = self.presenter.screen
 
         self.backgrounds = {
             'classic': BackgroundColor(self, (12,13,20)),
@@ -37,19 +52,14 @@ class DiceGame:
         }
         self.current_background = 'classic'
 
-        self.sounds = {
-            'step':pygame.mixer.Sound('sfx/step.wav'),
-            'pink':pygame.mixer.Sound('sfx/pink.ogg'),
-            'stars':pygame.mixer.Sound('sfx/stars.ogg'),
-            'type':pygame.mixer.Sound('sfx/type.wav'),
-            'reset':pygame.mixer.Sound('sfx/reset.wav'),
-            'win':pygame.mixer.Sound('sfx/win.wav'),
-            'invalid':pygame.mixer.Sound('sfx/invalid.wav'),
-            'blip':pygame.mixer.Sound('sfx/blip.wav'),
-        }
-        self.sounds['pink'].play(-1)
+        # Sounds are loaded as levels need them, MUSIC_STREAMS are never decoded
+        self.assets = AssetManager({name: filename for name, filename in SOUNDS.items() if name not in MUSIC_STREAMS})
+        self.level_sounds = []
+        self.music_pending = False
+        self.streaming = None
 
         self.text_manager = TextManager(self)
+        self.profiler = Profiler.from_env(self)
 
         if mobile:
             self.touch_control_rects = [
@@ -60,58 +70,134 @@ class DiceGame:
                 pygame.Rect(TOUCH_PADDING, SCREEN_HEIGHT-TOUCH_SIZE-TOUCH_PADDING, TOUCH_SIZE, TOUCH_SIZE),
             ]
 
-        self.die: IsoDie
+        self.levels = LevelRepository(default_level_source())
+        self.die = IsoDie(self)
         self.isometric = Isometric(self)
         self.load(0)
+        self.assets.prefetch(self.assets.sources) # Everything else loads in the background
+
+        self.ticks = 0 # Updates run since the game started
+        # Every move, so the session can be replayed. Only kept when it is going to be saved.
+        self.record_file = os.environ.get(RECORD_ENV)
+        self.log = MoveLog(self.lvl_id) if self.record_file else None
         
         self.camera = IsoCamera(self, pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
     
     def load(self, lvl):
-        with open('levels/dat.json') as f:
-            data = json.load(f)[lvl]
-        
+        self.level = self.levels.get(lvl)
+        self.state = initial_state(self.level)
+        self.levels.prefetch(lvl+1)
         
         self.lvl_id = lvl
-        self.current_background = data['background']
+        self.current_background = self.level.background
+
+        # Sounds are counted per level. The ones no level uses anymore stay loaded so going back to
+        # a level never decodes anything again, they are only dropped when the system runs low on memory.
+        sounds = self.sounds_for(self.level)
+        self.assets.acquire(sounds)
+        self.assets.release(self.level_sounds)
+        self.level_sounds = sounds
 
         pygame.mixer.stop()
-        if data['music']:
-            for m in data['music']:
-                self.sounds[m].play(-1)
+        pygame.mixer.music.stop()
+        self.music_pending = True
+        self.start_music()
 
-        self.isometric.load(f'levels/{self.lvl_id}.png')
-        self.die.layout = DieLayout.fromlist(data['die_layout'])
-        self.die.update_tex()
-        self.text_manager.load(data['texts'])
+        self.isometric.load(self.level)
+        self.isometric.sync(self.state)
+        self.text_manager.load(self.level.texts)
 
+    # Sounds that can play on a level, loaded before it starts
+    def sounds_for(self, level: Level) -> list:
+        events = [EVENT_MOVE, EVENT_BLOCKED, EVENT_GOAL, EVENT_RESET]
+        if level.timed:
+            events += [EVENT_VANISH, EVENT_RESTORE, EVENT_FALL]
+        names = [m for m in level.music if m not in MUSIC_STREAMS] + [EVENT_SOUNDS[event] for event in events]
+        if any(t['delay'] for t in level.texts):
+            names.append('type')
+        return list(dict.fromkeys(names))
+    
+    # Starts the level's music once every decoded track is loaded, so they all start together
+    def start_music(self):
+        if not all(m in self.assets or m in MUSIC_STREAMS for m in self.level.music):
+            return
+        for m in self.level.music:
+            if m in MUSIC_STREAMS:
+                if self.streaming != m:
+                    pygame.mixer.music.load(SOUNDS[m])
+                    self.streaming = m
+                pygame.mixer.music.play(-1)
+            else:
+                self.assets.get(m).play(-1)
+        self.music_pending = False
+    
+    def play_sound(self, name: str):
+        self.assets.get(name).play()
+
+    def process_events(self, events):
+        self.isometric.sync(self.state)
+        if EVENT_MOVE in events:
+            # The number rolled floats up from where the die landed, even when that loads the next level
+            number, position = f'{self.state.layout.bottom+1}', self.die.grid_position()
+        
+        if EVENT_GOAL in events:
+            self.load(self.lvl_id+1)
+        
+        if EVENT_MOVE in events:
+            self.isometric.spawn_text(number, position)
+        
+        for event in events:
+            self.play_sound(EVENT_SOUNDS[event])
+    
+    def move(self, move):
+        if self.log is not None:
+            self.log.record(self.ticks, move)
+        self.state, events = step(self.state, move)
+        self.process_events(events)
     
-    def reset(self, sfx='reset'):
-        with open('levels/dat.json') as f:
-            data = json.load(f)[self.lvl_id]
-        self.die.layout = DieLayout.fromlist(data['die_layout'])
-        self.die.update_tex()
-        self.die.position = self.die.default_position.copy()
-        self.sounds[sfx].play()
+    def reset(self):
+        self.move(MOVE_RESET)
     
     def process_touch_controls(self, mouse_pos: vec2):
         if self.touch_control_rects[0].collidepoint(mouse_pos):
-            self.die.move_right()
+            self.move(MOVE_RIGHT)
         if self.touch_control_rects[1].collidepoint(mouse_pos):
-            self.die.move_left()
+            self.move(MOVE_LEFT)
         if self.touch_control_rects[2].collidepoint(mouse_pos):
-            self.die.move_front()
+            self.move(MOVE_FRONT)
         if self.touch_control_rects[3].collidepoint(mouse_pos):
-            self.die.move_back()
+            self.move(MOVE_BACK)
         if self.touch_control_rects[4].collidepoint(mouse_pos):
             self.reset()
     
     def update(self):
-        self.text_manager.update()
-        self.isometric.update()
+        self.levels.poll()
+        self.assets.poll()
+        if self.music_pending:
+            self.start_music()
+        self.state, events = tick(self.state)
+        self.ticks += 1
+        self.process_events(events)
+
+        profiler = self.profiler
+        with profiler.section('text.upd'):
+            self.text_manager.update()
+        with profiler.section('iso.upd'):
+            self.isometric.update()
         # print(self.die.layout)
-        self.camera.update()
-        self.backgrounds[self.current_background].update()
+        with profiler.section('camera'):
+            self.camera.update()
+        with profiler.section('bg.upd'):
+            self.backgrounds[self.current_background].update()
     
+    def draw_loading(self):
+        self.screen.fill((12,13,20))
+        bar = pygame.Rect(0, 0, LOADING_BAR_WIDTH, LOADING_BAR_HEIGHT)
+        bar.center = (HALF_SCREEN_WIDTH, HALF_SCREEN_HEIGHT)
+        self.text_manager.blit('LOADING', vec2(bar.centerx - len('LOADING')*GLYPH_ADVANCE//2, bar.top - GLYPH_HEIGHT - 5))
+        pygame.draw.rect(self.screen, (255,255,255), bar.inflate(4, 4), 1)
+        pygame.draw.rect(self.screen, (255,255,255), (bar.left, bar.top, round(bar.width*self.assets.progress()), bar.height))
+
     def draw_move_options(self):
         self.screen.blit(pygame.transform.scale(self.die.faces[self.die.layout.back], (MV_OP_SIZE, MV_OP_SIZE)), (SCREEN_WIDTH-MV_OP_SIZE-MV_OP_PADDING, MV_OP_PADDING))
         pygame.draw.rect(self.screen, (255,255,255), [SCREEN_WIDTH-MV_OP_SIZE-MV_OP_PADDING-1, 1, MV_OP_SIZE+2, MV_OP_SIZE+2],1)
@@ -122,12 +208,24 @@ class DiceGame:
         self.screen.blit(pygame.transform.scale(self.die.faces[self.die.layout.front], (MV_OP_SIZE, MV_OP_SIZE)), (SCREEN_WIDTH-(MV_OP_SIZE+MV_OP_PADDING)*2, MV_OP_SIZE+MV_OP_PADDING*2))
         pygame.draw.rect(self.screen, (255,255,255), [SCREEN_WIDTH-(MV_OP_SIZE+MV_OP_PADDING)*2-1, MV_OP_SIZE+MV_OP_PADDING+1, MV_OP_SIZE+2, MV_OP_SIZE+2],1)
 
-    def draw(self):
-        self.backgrounds[self.current_background].draw()
+    # Everything draws on self.screen when it draws, so nothing else holds on to the old presenter's screen
+    def set_presenter(self, presenter):
+        self.presenter.close()
+        self.presenter = presenter
+        self.screen = presenter.screen
 
-        self.isometric.draw()
+    # alpha is how far the frame is between the last two updates, moving things are drawn in between
+    def draw(self, alpha=1.0):
+        profiler = self.profiler
+        self.camera.interpolate(alpha)
+        with profiler.section('bg.drw'):
+            self.backgrounds[self.current_background].draw()
 
-        self.text_manager.draw()
+        with profiler.section('iso.drw'):
+            self.isometric.draw(alpha)
+
+        with profiler.section('text.drw'):
+            self.text_manager.draw()
         self.text_manager.blit(f'LVL:{self.lvl_id}', vec2(5,5))
 
         if mobile:
@@ -137,6 +235,7 @@ class DiceGame:
             self.text_manager.blit('R', vec2(self.touch_control_rects[4].center)-vec2(3,4))
         
         self.draw_move_options()
+        profiler.draw()
 
 
 
@@ -145,35 +244,64 @@ async def main():
     gm = DiceGame()
     running = True
     clock = pygame.time.Clock() # To enforce FPS
+    lag = TICK_TIME # Milliseconds of game time that still have to be simulated
+
+    # The first level's sounds load behind a progress bar, one per frame so the page stays responsive
+    while not gm.assets.ready():
+        gm.assets.poll()
+        gm.draw_loading()
+        gm.presenter.present()
+        await asyncio.sleep(0)
+    clock.tick() # Loading time is not game time
 
     while running:
+        gm.profiler.begin_frame()
         for event in pygame.event.get():
-            if event.type == pygame.QUIT: # Check if window is exited
+            if event.type in (pygame.QUIT, pygame.WINDOWCLOSE): # Check if window is exited
                 running = False
+            if event.type == pygame.WINDOWEXPOSED:
+                gm.presenter.invalidate()
+            if event.type == pygame.APP_LOWMEMORY:
+                gm.assets.purge()
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_r or event.key == pygame.K_SPACE:
                     gm.reset()
                 elif event.key == pygame.K_d or event.key == pygame.K_RIGHT:
-                    gm.die.move_right()
+                    gm.move(MOVE_RIGHT)
                 elif event.key == pygame.K_a or event.key == pygame.K_LEFT:
-                    gm.die.move_left()
+                    gm.move(MOVE_LEFT)
                 elif event.key == pygame.K_s or event.key == pygame.K_DOWN:
-                    gm.die.move_front()
+                    gm.move(MOVE_FRONT)
                 elif event.key == pygame.K_w or event.key == pygame.K_UP:
-                    gm.die.move_back()
+                    gm.move(MOVE_BACK)
+                elif event.key == pygame.K_F3:
+                    gm.profiler.toggle()
             
             if mobile and event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_pos = vec2(event.pos)/RATIO
+                mouse_pos = gm.presenter.to_screen(event.pos)
                 gm.process_touch_controls(mouse_pos)
                 
         
-        gm.update()
-        gm.draw()
+        # The game updates at a fixed rate whatever the frame rate is, a slow frame runs several updates
+        ticks = 0
+        while lag >= TICK_TIME and ticks < MAX_TICKS_PER_FRAME:
+            gm.update()
+            lag -= TICK_TIME
+            ticks += 1
+        if ticks == MAX_TICKS_PER_FRAME:
+            lag = min(lag, TICK_TIME) # Too far behind to catch up, the game slows down instead
+        gm.draw(lag / TICK_TIME)
 
-        # Scale screen to fit window and blit, then update window
-        pygame.transform.scale(gm.screen, (WINDOW_WIDTH, WINDOW_HEIGHT), gm.window)
-        pygame.display.flip()
-        clock.tick(FPS)
+        with gm.profiler.section('present'):
+            gm.presenter.present()
+        gm.profiler.end_frame()
+        lag += clock.tick(FPS)
         await asyncio.sleep(0)
+    
+    gm.profiler.close()
+    if gm.log is not None:
+        gm.log.finish(gm.lvl_id, gm.state, gm.ticks)
+        gm.log.save(gm.record_file)
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == '__main__':
+    asyncio.run(main())
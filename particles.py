@@ -0,0 +1,70 @@
+from array import array
+
+
+PARTICLE_CAPACITY = 32 # Particles a pool has room for before it has to grow
+
+
+# Particles stored as parallel arrays (one per position and velocity component) instead of objects.
+# The arrays are allocated up front: live particles are packed at the front and the slots past count
+# are the free list, removing one moves the last particle into its place. Updates work in place and
+# never allocate, only spawning into a full pool does, doubling its capacity.
+class ParticlePool:
+    def __init__(self, dimensions: int, expires=True, capacity=PARTICLE_CAPACITY):
+        self.count = 0
+        self.capacity = capacity
+        self.positions = [array('d', [0.0])*capacity for d in range(dimensions)]
+        self.velocities = [array('d', [0.0])*capacity for d in range(dimensions)]
+        self.expires = expires
+        self.lifetimes = array('l', [0])*capacity # Frames left, not counted down when particles don't expire
+        self.data = [None]*capacity # Anything the owner wants to keep per particle, like the text of a text particle
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        for component in self.positions + self.velocities + [self.lifetimes, self.data]:
+            component.extend(component[:1]*self.capacity)
+        self.capacity *= 2
+
+    def spawn(self, position, velocity, lifetime=0, data=None):
+        if self.count == self.capacity:
+            self._grow()
+        i = self.count
+        for component, value in zip(self.positions, position):
+            component[i] = value
+        for component, value in zip(self.velocities, velocity):
+            component[i] = value
+        self.lifetimes[i] = lifetime
+        self.data[i] = data
+        self.count += 1
+
+    def kill(self, i: int):
+        last = self.count - 1
+        for component in self.positions + self.velocities + [self.lifetimes, self.data]:
+            component[i] = component[last]
+        self.data[last] = None
+        self.count = last
+
+    def clear(self):
+        self.data[:self.count] = [None]*self.count
+        self.count = 0
+
+    # Position alpha of the way from the previous update to the last one, particles move in straight lines
+    def position(self, i: int, alpha=1.0) -> tuple:
+        back = alpha - 1
+        return tuple(position[i] + velocity[i]*back for position, velocity in zip(self.positions, self.velocities))
+
+    # Moves every particle by its velocity, then removes the expired ones
+    def update(self):
+        count = self.count
+        for position, velocity in zip(self.positions, self.velocities):
+            for i in range(count):
+                position[i] += velocity[i]
+
+        if self.expires:
+            lifetimes = self.lifetimes
+            # From the back, so a killed particle is replaced by one that was already counted down
+            for i in range(count-1, -1, -1):
+                lifetimes[i] -= 1
+                if not lifetimes[i]:
+                    self.kill(i)
@@ -0,0 +1,141 @@
+# Ways of putting the game's low resolution screen on the window, picked with DICE_PRESENT:
+#   software  (default) the screen is scaled onto a WINDOW_WIDTH x WINDOW_HEIGHT window on the CPU, a million pixels a frame
+#   scaled    the window surface is the screen itself and SDL scales it up (pygame's SCALED flag)
+#   renderer  the screen is uploaded to a texture that SDL's renderer draws RATIO times bigger, nearest neighbour
+# Frames that are the same as the last one presented are not presented again, DICE_PRESENT_SKIP=0 turns that off.
+
+import os
+import pygame
+from pygame.math import Vector2 as vec2
+
+from constants import *
+
+
+PRESENT_ENV = 'DICE_PRESENT'
+PRESENT_SKIP_ENV = 'DICE_PRESENT_SKIP'
+PRESENT_DEFAULT = 'software' # The others are only faster where SDL's renderer is accelerated, measure with benchmark.py
+PRESENT_FALLBACK = 'software' # Used when a mode can't be opened on this platform
+
+PRESENTERS = {} # Presenter class by mode
+
+def presenter(mode: str):
+    def register(cls):
+        cls.mode = mode
+        PRESENTERS[mode] = cls
+        return cls
+    return register
+
+
+class Presenter:
+    mode = None
+
+    def __init__(self, skip_unchanged=True):
+        self.skip_unchanged = skip_unchanged
+        self.last = None # Pixels of the last frame presented, allocated once and copied into after that
+        self.stale = True # The next frame is presented whatever it looks like
+        self.presented = 0
+        self.skipped = 0
+        self.screen = self.open() # What the game draws on
+
+    def open(self) -> pygame.Surface:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    # Window coordinates (of a mouse event) to screen coordinates
+    def to_screen(self, pos) -> vec2:
+        return vec2(pos)
+
+    # Presents the next frame even if it is unchanged, for when the window's contents were lost
+    def invalidate(self):
+        self.stale = True
+
+    # Comparing the 150KB of pixels is a memcmp, against a million pixels to scale
+    def changed(self) -> bool:
+        if not self.skip_unchanged:
+            return True
+        pixels = self.screen.get_view('1')
+        if self.last is None:
+            self.last = bytearray(pixels)
+        elif not self.stale and self.last == pixels:
+            return False
+        else:
+            self.last[:] = pixels
+        self.stale = False
+        return True
+
+    # Puts the screen on the window, returns False if the frame was skipped
+    def present(self) -> bool:
+        if not self.changed():
+            self.skipped += 1
+            return False
+        self._present()
+        self.presented += 1
+        return True
+
+    def _present(self):
+        pygame.display.flip()
+
+
+@presenter('software')
+class SoftwarePresenter(Presenter):
+    def open(self):
+        self.window = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+        return pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+
+    def to_screen(self, pos):
+        return vec2(pos)/RATIO
+
+    def _present(self):
+        pygame.transform.scale(self.screen, (WINDOW_WIDTH, WINDOW_HEIGHT), self.window)
+        pygame.display.flip()
+
+
+# SDL picks the biggest whole multiple of the screen that fits the desktop, and maps mouse events back to the screen
+@presenter('scaled')
+class ScaledPresenter(Presenter):
+    def open(self):
+        return pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SCALED)
+
+
+# The renderer's logical size is the screen, SDL maps mouse events back to it
+@presenter('renderer')
+class RendererPresenter(Presenter):
+    def open(self):
+        from pygame._sdl2.video import Window, Renderer, Texture
+        size = (int(SCREEN_WIDTH), int(SCREEN_HEIGHT))
+        # Surfaces are converted to the display module's format, but a renderer can't share a window with
+        # a display surface, so the display module only gets a hidden window. Closing the game's window
+        # doesn't quit SDL while that one is open, the main loop stops on WINDOWCLOSE as well.
+        pygame.display.set_mode((1, 1), pygame.HIDDEN)
+        caption = pygame.display.get_caption()
+        self.window = Window(caption[0] if caption else '', (WINDOW_WIDTH, WINDOW_HEIGHT))
+        self.renderer = Renderer(self.window)
+        self.renderer.logical_size = size
+        self.texture = Texture(self.renderer, size, streaming=True)
+        return pygame.Surface(size)
+
+    def close(self):
+        self.window.destroy()
+
+    def _present(self):
+        self.texture.update(self.screen)
+        self.renderer.clear()
+        self.renderer.blit(self.texture)
+        self.renderer.present()
+
+
+# Opens the presenter picked by DICE_PRESENT unless a mode is given, falls back to software if it can't be opened
+def open_presenter(mode=None, skip_unchanged=None) -> Presenter:
+    mode = mode or os.environ.get(PRESENT_ENV) or PRESENT_DEFAULT
+    if skip_unchanged is None:
+        skip_unchanged = os.environ.get(PRESENT_SKIP_ENV, '1') not in ('', '0')
+    if mode not in PRESENTERS:
+        raise ValueError(f'unknown present mode {mode}, expected one of {", ".join(PRESENTERS)}')
+    try:
+        return PRESENTERS[mode](skip_unchanged)
+    except (ImportError, RuntimeError): # pygame.error and the renderer's errors are RuntimeErrors
+        if mode == PRESENT_FALLBACK:
+            raise
+        return PRESENTERS[PRESENT_FALLBACK](skip_unchanged)
@@ -0,0 +1,131 @@
+import os
+import csv
+import json
+import time
+from collections import deque
+
+from pygame.math import Vector2 as vec2
+
+from text import GLYPH_ADVANCE
+
+
+PROFILE_WINDOW = 240 # Frames kept per section for the rolling percentiles
+PROFILE_PERCENTILES = (50, 95, 99)
+PROFILE_HUD_INTERVAL = 30 # Frames between HUD refreshes, so the text cache isn't flooded with numbers
+PROFILE_HUD_POSITION = (5, 16)
+PROFILE_LINE_HEIGHT = 8
+PROFILE_HUD_COLOR = (12,13,20) # Backdrop keeping the numbers readable over the level
+PROFILE_ENV = 'DICE_PROFILE' # Set to 1 to start with the profiler on
+PROFILE_TRACE_ENV = 'DICE_PROFILE_TRACE' # Trace file, written as JSON if it ends in .json, as CSV otherwise
+
+
+class _Section:
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+# Stands in for a section while the profiler is off
+class _NullSection:
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+
+_NULL_SECTION = _NullSection()
+
+
+def percentile(samples, p) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered)-1, len(ordered)*p//100)]
+
+
+# Times named sections of the frame, keeps their rolling percentiles and draws them as a HUD.
+# Sections are timed with `with profiler.section(name):`, a frame is everything between begin_frame and end_frame.
+class Profiler:
+    def __init__(self, gm, enabled=False, trace=None, window=PROFILE_WINDOW):
+        self.gm = gm
+        self.enabled = enabled
+        self.trace = trace
+        self.window = window
+
+        self.sections = {}
+        self.samples = {} # Milliseconds per section, the last `window` frames
+        self.frame = {} # Milliseconds per section of the frame in progress
+        self.frames = [] # Every recorded frame, only kept when tracing
+        self.frame_start = time.perf_counter()
+        self.frame_count = 0
+        self.lines = []
+
+    @classmethod
+    def from_env(cls, gm):
+        return cls(gm, os.environ.get(PROFILE_ENV, '0') not in ('', '0'), os.environ.get(PROFILE_TRACE_ENV) or None)
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frame.clear()
+
+    def section(self, name: str):
+        if not self.enabled:
+            return _NULL_SECTION
+        section = self.sections.get(name)
+        if section is None:
+            section = self.sections[name] = _Section(self, name)
+            self.samples[name] = deque(maxlen=self.window)
+        return section
+
+    def record(self, name: str, seconds: float):
+        self.frame[name] = self.frame.get(name, 0.0) + seconds*1000
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if self.enabled:
+            self.record('frame', time.perf_counter() - self.frame_start)
+            self.samples.setdefault('frame', deque(maxlen=self.window))
+            for name, ms in self.frame.items():
+                self.samples[name].append(ms)
+            if self.trace:
+                self.frames.append({'index': self.frame_count, **{name: round(ms, 4) for name, ms in self.frame.items()}})
+            if self.frame_count % PROFILE_HUD_INTERVAL == 0:
+                self.lines = self.summary_lines()
+            self.frame.clear()
+        self.frame_count += 1
+
+    # Percentiles in milliseconds by section
+    def stats(self) -> dict:
+        return {name: [percentile(samples, p) for p in PROFILE_PERCENTILES] for name, samples in self.samples.items() if samples}
+
+    def summary_lines(self) -> list:
+        lines = ['ms       ' + ''.join(f'p{p:<5}' for p in PROFILE_PERCENTILES)]
+        for name, values in self.stats().items():
+            lines.append(f'{name:<9}' + ''.join(f'{v:<6.2f}' for v in values))
+        return lines
+
+    def draw(self):
+        if not self.enabled:
+            return
+        x, y = PROFILE_HUD_POSITION
+        width = max(map(len, self.lines), default=0)*GLYPH_ADVANCE
+        self.gm.screen.fill(PROFILE_HUD_COLOR, (x-1, y-1, width+1, len(self.lines)*PROFILE_LINE_HEIGHT+1))
+        for i, line in enumerate(self.lines):
+            self.gm.text_manager.blit(line, vec2(x, y + i*PROFILE_LINE_HEIGHT))
+
+    # Writes the trace file, if there is one
+    def close(self):
+        if not self.trace or not self.frames:
+            return
+        if self.trace.endswith('.json'):
+            with open(self.trace, 'w') as f:
+                json.dump({'window': self.window, 'stats': self.stats(), 'frames': self.frames}, f)
+        else:
+            names = ['index'] + list(self.samples)
+            with open(self.trace, 'w', newline='') as f:
+                writer = csv.DictWriter(f, names, restval='')
+                writer.writeheader()
+                writer.writerows(self.frames)
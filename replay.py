@@ -0,0 +1,160 @@
+# Records the moves of a session and replays them faster than real time.
+#   DICE_RECORD=session.json python main.py      Record a session, saved when the game is closed
+#   python replay.py session.json                 Replay the rules only, fast forwarding between moves
+#   python replay.py session.json --verify        Also check the final level, die position and layout, exit 1 if they differ
+#   python replay.py session.json --game          Replay through the whole game headless, DICE_PROFILE=1 times it
+#   python replay.py replays/*.json --verify      Check the rules against the recorded sessions, run after changing them,
+#                                                 advance is also checked against ticking every update
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from constants import TICK_RATE
+from simulation import *
+
+
+RECORD_ENV = 'DICE_RECORD' # File the session's moves are saved to when the game closes
+
+
+# Where a session ended up, what a replay has to reproduce. The timed tiles that are gone and the
+# pending changes (updates until due, slot) are included so a change to their timing shows up too.
+def summarize(lvl: int, state: GameState) -> dict:
+    return {
+        'level': lvl, 'x': state.x, 'y': state.y, 'layout': list(state.layout.faces()),
+        'gone': sorted(state.gone), 'schedule': sorted([due - state.clock, slot] for due, slot in state.schedule),
+    }
+
+# Sessions recorded before a field was summarized are checked on the fields they have
+def matches(result: dict, final: dict) -> bool:
+    return final is not None and all(result.get(key) == value for key, value in final.items())
+
+
+# The moves of a session with the update they happened before, counted from the start of the session
+class MoveLog:
+    def __init__(self, level=0, moves=None, ticks=0, final=None):
+        self.level = level # Level the session started on
+        self.moves = moves if moves is not None else [] # [tick, move] pairs, in order
+        self.ticks = ticks # Updates run in the whole session
+        self.final = final
+
+    def record(self, tick: int, move: str):
+        self.moves.append([tick, move])
+
+    def finish(self, lvl: int, state: GameState, ticks: int):
+        self.ticks = ticks
+        self.final = summarize(lvl, state)
+
+    def save(self, filename: str):
+        with open(filename, 'w') as f:
+            json.dump({'level': self.level, 'ticks': self.ticks, 'final': self.final, 'moves': self.moves}, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename: str):
+        with open(filename) as f:
+            data = json.load(f)
+        return cls(data['level'], data['moves'], data['ticks'], data.get('final'))
+
+
+# Calls tick frames times, what advance has to be the same as
+def tick_by_tick(state: GameState, frames: int):
+    events = []
+    for frame in range(frames):
+        state, ticked = tick(state)
+        events += ticked
+    return state, tuple(events)
+
+# Replays the rules only, the updates between two moves are skipped over with advance.
+# Returns the level and state the session ended on.
+def replay(log: MoveLog, levels=None):
+    levels = levels or LevelRepository()
+    lvl = log.level
+    state = initial_state(levels.get(lvl))
+    ticks = 0
+    for tick, move in log.moves:
+        state = advance(state, tick - ticks)[0]
+        ticks = tick
+        state, events = step(state, move)
+        if EVENT_GOAL in events:
+            lvl += 1
+            state = initial_state(levels.get(lvl))
+    state = advance(state, log.ticks - ticks)[0]
+    return lvl, state
+
+# Replays through DiceGame one update at a time, as the main loop would without waiting for the clock
+def replay_game(log: MoveLog, draw=True):
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    from main import DiceGame
+
+    gm = DiceGame()
+    gm.load(log.level)
+    moves = iter(log.moves)
+    pending = next(moves, None)
+    for tick in range(log.ticks + 1):
+        gm.profiler.begin_frame()
+        while pending and pending[0] == tick:
+            gm.move(pending[1])
+            pending = next(moves, None)
+        if tick == log.ticks:
+            break
+        gm.update()
+        if draw:
+            gm.draw()
+            with gm.profiler.section('present'):
+                gm.presenter.present()
+        gm.profiler.end_frame()
+    gm.profiler.close()
+    return gm.lvl_id, gm.state
+
+# Replays the session with advance and with tick_by_tick side by side, returns the update
+# after which their states or events first differ, None if they never do
+def check_advance(log: MoveLog, levels=None):
+    levels = levels or LevelRepository()
+    lvl = log.level
+    state = initial_state(levels.get(lvl))
+    ticks = 0
+    for moved_at, move in log.moves + [[log.ticks, None]]:
+        advanced, events = advance(state, moved_at - ticks)
+        state, ticked = tick_by_tick(state, moved_at - ticks)
+        if (state_key(advanced), advanced.clock, events) != (state_key(state), state.clock, ticked):
+            return moved_at
+        ticks = moved_at
+        if move:
+            state, events = step(state, move)
+            if EVENT_GOAL in events:
+                lvl += 1
+                state = initial_state(levels.get(lvl))
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays a recorded session faster than real time.')
+    parser.add_argument('logs', nargs='+', help='sessions recorded with DICE_RECORD')
+    parser.add_argument('--verify', action='store_true', help='exit 1 if the replay does not end where the session did')
+    parser.add_argument('--game', action='store_true', help='replay through the whole game instead of the rules only')
+    parser.add_argument('--no-draw', action='store_true', help='with --game, only run the updates')
+    args = parser.parse_args()
+
+    mismatched = False
+    for filename in args.logs:
+        log = MoveLog.load(filename)
+        start = time.perf_counter()
+        lvl, state = replay_game(log, not args.no_draw) if args.game else replay(log)
+        elapsed = time.perf_counter() - start
+
+        result = summarize(lvl, state)
+        print(f'{filename}: {len(log.moves)} moves over {log.ticks} updates in {elapsed:.3f}s ({log.ticks / TICK_RATE / max(elapsed, 1e-9):.0f}x real time)')
+        print(f'Ended on {result}')
+        if args.verify:
+            if not matches(result, log.final):
+                print(f'Mismatch, the session ended on {log.final}')
+                mismatched = True
+            elif not args.game and (differs := check_advance(log)) is not None:
+                print(f'Mismatch, advance and ticking every update differ after update {differs}')
+                mismatched = True
+            else:
+                print('Verified')
+    sys.exit(1 if mismatched else 0)
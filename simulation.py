@@ -0,0 +1,400 @@
+# Render free game rules, everything here runs without a display or an audio device.
+# The game (DiceGame) is a presentation layer over GameState and step/tick.
+
+import os
+import json
+from array import array
+from bisect import bisect_left
+from heapq import heappush, heappop
+from collections import namedtuple, OrderedDict
+
+
+LEVELS_DIRECTORY = 'levels'
+LEVEL_PACK = 'levels.pack' # LEVELS_DIRECTORY packed into one file by levelpack.py
+LEVEL_CACHE_SIZE = 8 # Decoded levels kept by a LevelRepository
+
+# Tile IDs, also used as indices into the block textures
+TILE_FLOOR = 0 # Blue
+TILE_WALL = 1  # Orange
+TILE_START = 2 # Green
+TILE_GOAL = 3  # Red
+TILE_TIMED = 4 # White
+TILE_VOID = 5  # Timed tile while it is gone
+TILE_NONE = 0xFF
+TILE_UNKNOWN = 0xFE # Only used while decoding, for colours that are not in the palette
+
+# Level image colours
+TILE_COLORS = {
+    (0,0,0xFF): TILE_FLOOR,
+    (0xFF,0x7F,0): TILE_WALL,
+    (0,0xFF,0): TILE_START,
+    (0xFF,0,0): TILE_GOAL,
+    (0x64,0x64,0x64): TILE_TIMED,
+}
+
+class _TilePalette(dict):
+    def __missing__(self, color):
+        return TILE_UNKNOWN
+
+TILE_PALETTE = _TilePalette(TILE_COLORS)
+TILE_PALETTE[(0,0,0)] = TILE_NONE
+
+TIMED_TILE_TIME = 60 # Frames a stepped on timed tile stays, and stays gone
+
+MOVE_RIGHT = 'right'
+MOVE_LEFT = 'left'
+MOVE_FRONT = 'front'
+MOVE_BACK = 'back'
+MOVE_RESET = 'reset'
+MOVES = (MOVE_RIGHT, MOVE_LEFT, MOVE_FRONT, MOVE_BACK)
+
+EVENT_MOVE = 'move'       # The die rolled onto a new tile
+EVENT_BLOCKED = 'blocked' # The move was not allowed
+EVENT_GOAL = 'goal'       # The die reached a red tile
+EVENT_VANISH = 'vanish'   # A timed tile is gone
+EVENT_RESTORE = 'restore' # A timed tile came back
+EVENT_FALL = 'fall'       # The tile under the die vanished, the die is back at the start
+EVENT_RESET = 'reset'     # The player reset the die
+
+
+DIE_FACES = 6 # Number of face textures a layout can refer to
+
+ROLL_RIGHT = 0
+ROLL_LEFT = 1
+ROLL_FRONT = 2
+ROLL_BACK = 3
+
+# Slot permutations for each roll, slots are ordered as in fromlist: top, bottom, right, left, front, back
+ROLL_PERMUTATIONS = (
+    (3, 2, 0, 1, 4, 5), # Right
+    (2, 3, 1, 0, 4, 5), # Left
+    (5, 4, 2, 3, 0, 1), # Front
+    (4, 5, 2, 3, 1, 0), # Back
+)
+
+# Immutable and interned, equal layouts are the same object so they can be used as keys directly.
+# Creating a layout also creates every layout it can roll into, so a roll is a single table lookup.
+class DieLayout:
+    __slots__ = ('top', 'bottom', 'right', 'left', 'front', 'back', 'key', 'rolls')
+    _interned = {}
+
+    def __new__(cls, top, bottom, right, left, front, back):
+        faces = (top, bottom, right, left, front, back)
+        layout = cls._interned.get(faces)
+        if layout is not None:
+            return layout
+        
+        orbit = [cls._create(faces)]
+        for layout in orbit:
+            rolls = []
+            for permutation in ROLL_PERMUTATIONS:
+                rolled = tuple(layout.faces()[i] for i in permutation)
+                if rolled not in cls._interned:
+                    orbit.append(cls._create(rolled))
+                rolls.append(cls._interned[rolled])
+            object.__setattr__(layout, 'rolls', tuple(rolls))
+        return orbit[0]
+    
+    @classmethod
+    def _create(cls, faces):
+        for face in faces:
+            if not (isinstance(face, int) and 0 <= face < DIE_FACES):
+                raise ValueError(f'Invalid die face {face!r} in {faces}')
+        
+        layout = object.__new__(cls)
+        for name, face in zip(cls.__slots__, faces):
+            object.__setattr__(layout, name, face)
+        # Faces packed in base DIE_FACES, a compact key for tables and caches
+        object.__setattr__(layout, 'key', sum(face * DIE_FACES**i for i, face in enumerate(faces)))
+        cls._interned[faces] = layout
+        return layout
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('DieLayout is immutable')
+    
+    def __reduce__(self):
+        return (DieLayout.fromlist, (list(self.faces()),))
+    
+    def __repr__(self):
+        return f'DieLayout(top: {self.top}, bottom: {self.bottom}, right: {self.right}, left: {self.left}, front: {self.front}, back: {self.back})'
+
+    def faces(self) -> tuple:
+        return (self.top, self.bottom, self.right, self.left, self.front, self.back)
+    
+    @staticmethod
+    def fromlist(l):
+        return DieLayout(l[0],l[1],l[2],l[3],l[4],l[5])
+    
+    @staticmethod
+    def fromkey(key: int):
+        return DieLayout.fromlist([key // DIE_FACES**i % DIE_FACES for i in range(6)])
+    
+    def roll(self, direction: int):
+        return self.rolls[direction]
+    
+    def roll_front(self):
+        return self.rolls[ROLL_FRONT]
+    def roll_back(self):
+        return self.rolls[ROLL_BACK]
+    def roll_right(self):
+        return self.rolls[ROLL_RIGHT]
+    def roll_left(self):
+        return self.rolls[ROLL_LEFT]
+
+
+# Roll and grid direction of each move
+MOVE_DIRECTIONS = {
+    MOVE_RIGHT: (ROLL_RIGHT, 1, 0),
+    MOVE_LEFT: (ROLL_LEFT, -1, 0),
+    MOVE_FRONT: (ROLL_FRONT, 0, 1),
+    MOVE_BACK: (ROLL_BACK, 0, -1),
+}
+
+
+class Level:
+    # start and timed are worked out from tiles unless they are given, a level pack stores them
+    def __init__(self, width: int, height: int, tiles: bytearray, data: dict, start=None, timed=None):
+        self.width = width
+        self.height = height
+        self.tiles = tiles # Row major tile IDs, TILE_NONE where there is no tile
+        self.die_layout = DieLayout.fromlist(data['die_layout'])
+        self.background = data['background']
+        self.music = data['music']
+        self.texts = data['texts']
+        self.time = TIMED_TILE_TIME
+
+        if start is None:
+            start = tiles.rfind(TILE_START)
+        self.start = (start % width, start // width) if start >= 0 else None
+        # Sorted indices of the timed tiles, a timed tile's slot is its position in this array.
+        # Together with tiles that is all a level keeps per tile, a little over a byte.
+        if timed is None:
+            timed = array('i')
+            i = tiles.find(TILE_TIMED)
+            while i >= 0:
+                timed.append(i)
+                i = tiles.find(TILE_TIMED, i+1)
+        self.timed = timed
+    
+    # Slot of the timed tile at a tile index, None if there is no timed tile there
+    def timed_slot(self, index: int):
+        slot = bisect_left(self.timed, index)
+        if slot < len(self.timed) and self.timed[slot] == index:
+            return slot
+        return None
+    
+    # Something indexed like a bytearray with the offsets of the rows and columns in it:
+    # cells[rows[y] + columns[x]] is the tile at x, y. The tiles themselves unless they say otherwise.
+    def cells(self) -> tuple:
+        if hasattr(self.tiles, 'cells'):
+            return self.tiles.cells()
+        return self.tiles, range(0, self.width*self.height, self.width), range(self.width)
+    
+    def tile(self, x: int, y: int) -> int:
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.tiles[y*self.width + x]
+        return TILE_NONE
+
+
+# Maps every pixel through the palette in a single pass, raises ValueError for unknown colours
+def decode_level_image(image_filename: str):
+    # Only the image module is needed, decoding works without a display
+    import pygame
+    im = pygame.image.load(image_filename)
+    width, height = im.get_size()
+    pixels = pygame.image.tobytes(im, 'RGB')
+    channels = iter(pixels)
+    tiles = bytearray(map(TILE_PALETTE.__getitem__, zip(channels, channels, channels)))
+
+    if TILE_UNKNOWN in tiles:
+        unknown = {}
+        i = tiles.find(TILE_UNKNOWN)
+        while i >= 0:
+            unknown.setdefault(pixels[i*3:i*3+3].hex(), (i % width, i // width))
+            i = tiles.find(TILE_UNKNOWN, i+1)
+        colors = ', '.join(f'#{color} at {position}' for color, position in unknown.items())
+        raise ValueError(f'{image_filename}: unknown colours {colors}')
+    return width, height, tiles
+
+def load_level_data(directory=LEVELS_DIRECTORY) -> list:
+    with open(f'{directory}/dat.json') as f:
+        return json.load(f)
+
+def load_level(lvl: int, directory=LEVELS_DIRECTORY) -> Level:
+    data = load_level_data(directory)[lvl]
+    return Level(*decode_level_image(f'{directory}/{lvl}.png'), data)
+
+
+# The level pack if it has been built since anything in the level directory last changed
+# (dat.json, a level image, or a level added or removed) by this version of levelpack.py,
+# the level directory otherwise
+def default_level_source() -> str:
+    from levelpack import is_current_pack
+    try:
+        packed = os.stat(LEVEL_PACK).st_mtime_ns
+        with os.scandir(LEVELS_DIRECTORY) as entries:
+            changed = max([os.stat(LEVELS_DIRECTORY).st_mtime_ns] + [entry.stat().st_mtime_ns for entry in entries])
+        current = packed >= changed and is_current_pack(LEVEL_PACK)
+    except OSError:
+        return LEVELS_DIRECTORY
+    return LEVEL_PACK if current else LEVELS_DIRECTORY
+
+
+# Parses dat.json once and keeps the most recently used decoded levels.
+# A level pack (a file instead of a directory) is opened instead, its levels are read in place without decoding.
+# Levels are never modified by the simulation so they can be shared between states.
+class LevelRepository:
+    def __init__(self, directory=LEVELS_DIRECTORY, cache_size=LEVEL_CACHE_SIZE):
+        self.directory = directory
+        self.cache_size = cache_size
+        if os.path.isfile(directory):
+            from levelpack import LevelPack
+            self.pack = LevelPack(directory)
+            self.data = None
+        else:
+            self.pack = None
+            self.data = load_level_data(directory)
+        self.cache = OrderedDict()
+        self.queue = [] # Levels to decode ahead of time
+    
+    def __len__(self):
+        return len(self.pack) if self.pack is not None else len(self.data)
+    
+    def _decode(self, lvl: int) -> Level:
+        if self.pack is not None:
+            return self.pack.level(lvl)
+        return Level(*decode_level_image(f'{self.directory}/{lvl}.png'), self.data[lvl])
+    
+    def get(self, lvl: int) -> Level:
+        level = self.cache.get(lvl)
+        if level is None:
+            level = self._decode(lvl)
+            self.cache[lvl] = level
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(lvl)
+        return level
+    
+    # Queues a level to be decoded by poll
+    def prefetch(self, lvl: int):
+        if 0 <= lvl < len(self) and lvl not in self.cache and lvl not in self.queue:
+            self.queue.append(lvl)
+    
+    # Decodes one queued level, meant to be called once per frame so the work is spread out
+    def poll(self):
+        if self.queue:
+            self.get(self.queue.pop(0))
+
+
+# Timed tiles change on a schedule instead of being counted down every frame:
+#   clock     updates counted while a change is pending, it stands still (at 0) when nothing is scheduled
+#   schedule  heap of (clock, slot) at which a timed tile vanishes, or comes back if it is gone
+#   gone      slots of the timed tiles that are gone
+GameState = namedtuple('GameState', ('level', 'x', 'y', 'layout', 'clock', 'schedule', 'gone'))
+
+def initial_state(level: Level) -> GameState:
+    return GameState(level, level.start[0], level.start[1], level.die_layout, 0, (), frozenset())
+
+# Identifies the situation a state is in, states that only differ by their clock play out the same
+def state_key(state: GameState) -> tuple:
+    return (state.x, state.y, state.layout, tuple(sorted((due - state.clock, slot) for due, slot in state.schedule)), state.gone)
+
+def tile_at(state: GameState, x: int, y: int) -> int:
+    tile = state.level.tile(x, y)
+    if tile == TILE_TIMED and state.level.timed_slot(y*state.level.width + x) in state.gone:
+        return TILE_VOID
+    return tile
+
+def is_won(state: GameState) -> bool:
+    return state.level.tile(state.x, state.y) == TILE_GOAL
+
+def reset(state: GameState) -> GameState:
+    return state._replace(x=state.level.start[0], y=state.level.start[1], layout=state.level.die_layout)
+
+# Applies a player move, returns the new state and the events it caused
+def step(state: GameState, move: str):
+    if move == MOVE_RESET:
+        return reset(state), (EVENT_RESET,)
+    
+    roll, dx, dy = MOVE_DIRECTIONS[move]
+    layout = state.layout.rolls[roll]
+    level = state.level
+    # The die moves as many tiles as the number it rolled onto, walls block the way
+    distance = layout.bottom+1
+    x = state.x + dx*distance
+    y = state.y + dy*distance
+    if not (0 <= x < level.width and 0 <= y < level.height):
+        return state, (EVENT_BLOCKED,)
+    
+    tiles = level.tiles
+    index = state.y*level.width + state.x
+    stride = dx + dy*level.width
+    for s in range(distance):
+        index += stride
+        if tiles[index] == TILE_WALL:
+            return state, (EVENT_BLOCKED,)
+    
+    tile = tiles[index]
+    if tile == TILE_NONE:
+        return state, (EVENT_BLOCKED,)
+    
+    schedule = state.schedule
+    if tile == TILE_TIMED:
+        slot = bisect_left(level.timed, index) # The tile is timed so it is in the array
+        if slot in state.gone:
+            return state, (EVENT_BLOCKED,)
+        # Stepping on an untouched timed tile schedules its vanishing, only scheduled tiles cost anything
+        if all(pending != slot for due, pending in schedule):
+            schedule = list(schedule)
+            heappush(schedule, (state.clock + level.time, slot))
+            schedule = tuple(schedule)
+    
+    state = GameState(level, x, y, layout, state.clock, schedule, state.gone)
+    if tile == TILE_GOAL:
+        return state, (EVENT_MOVE, EVENT_GOAL)
+    return state, (EVENT_MOVE,)
+
+# Applies the scheduled changes due by clock: a vanishing tile schedules its return,
+# and the die falls back to the start if the tile under it vanished
+def _run_schedule(state: GameState, clock: int):
+    level = state.level
+    schedule = list(state.schedule)
+    gone = set(state.gone)
+    die_slot = level.timed_slot(state.y*level.width + state.x)
+    events = []
+    fall = False
+    while schedule and schedule[0][0] <= clock:
+        due, slot = heappop(schedule)
+        if slot in gone:
+            gone.discard(slot)
+            events.append(EVENT_RESTORE)
+        else:
+            gone.add(slot)
+            heappush(schedule, (due + level.time, slot))
+            events.append(EVENT_VANISH)
+            fall = fall or slot == die_slot
+    
+    state = GameState(level, state.x, state.y, state.layout, clock if schedule else 0, tuple(schedule), frozenset(gone))
+    if fall:
+        state = reset(state)
+        events.append(EVENT_FALL)
+    return state, tuple(events)
+
+# Advances the state by one frame, only the clock moves until a change is due
+def tick(state: GameState):
+    if not state.schedule:
+        return state, ()
+    clock = state.clock + 1
+    if state.schedule[0][0] > clock:
+        return state._replace(clock=clock), ()
+    return _run_schedule(state, clock)
+
+# Same as calling tick frames times, the changes are applied in the order they are due
+def advance(state: GameState, frames: int):
+    if not frames or not state.schedule:
+        return state, ()
+    clock = state.clock + frames
+    if state.schedule[0][0] > clock:
+        return state._replace(clock=clock), ()
+    return _run_schedule(state, clock)
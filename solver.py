@@ -0,0 +1,260 @@
+# Finds the shortest solution of a level with A* over the simulation states
+# (die position, die layout and timed tile phases).
+#
+# The search runs the rules of simulation.step and advance on its own encoding instead of GameStates:
+#   base     tile index of the die times the number of layouts plus the index of its layout
+#   pending  sorted tuple of slot << PENDING_BITS | frames until the timed tile is back, the tile is gone
+#            while that is at most the level's time. Empty while nothing is scheduled, the state is then
+#            keyed by base alone.
+# A pending tile the die can't land on again before it is back is dropped: by the time the die could get
+# there it is untouched, which is what the search takes a tile without an entry to be.
+
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from heapq import heappush, heappop
+
+from simulation import *
+
+
+MOVE_WAIT = 'wait' # Let the timed tiles run for a move's worth of frames without moving
+FRAMES_PER_MOVE = 15 # Frames assumed to pass between two moves
+PENDING_BITS = 16 # The slot of a pending entry is shifted above the frames until the tile is back
+PENDING_MASK = (1 << PENDING_BITS) - 1
+
+
+class SolverResult:
+    def __init__(self, moves, explored: int, generated: int, elapsed: float):
+        self.moves = moves # None when the level could not be solved
+        self.explored = explored
+        self.generated = generated
+        self.elapsed = elapsed
+
+    @property
+    def solved(self) -> bool:
+        return self.moves is not None
+
+    # Number of die rolls, waiting is free
+    @property
+    def length(self) -> int:
+        return sum(1 for move in self.moves if move != MOVE_WAIT) if self.solved else None
+
+    def __repr__(self):
+        return f'SolverResult(moves: {self.moves}, explored: {self.explored}, generated: {self.generated}, elapsed: {self.elapsed:.4f}s)'
+
+
+# Every layout the die can roll into from the given ones, in the order they are found
+def layout_orbit(*layouts) -> list:
+    orbit = list(dict.fromkeys(layouts))
+    found = set(orbit)
+    for layout in orbit:
+        for rolled in layout.rolls:
+            if rolled not in found:
+                found.add(rolled)
+                orbit.append(rolled)
+    return orbit
+
+# Rolls needed from every (tile index, layout index) to the closest goal (-1 where none can be reached)
+# with the timed tiles left out of the rules. Timed tiles only take landings away or put the die back
+# on the start, so from a level with them the lower of this and the start's is an admissible heuristic.
+def goal_distances(width: int, height: int, tiles: bytes, layouts: list) -> array:
+    layout_count = len(layouts)
+    layout_index = {layout: i for i, layout in enumerate(layouts)}
+    # Layout a roll came from, each roll undoes the opposite one
+    unrolled = [[layout_index[layout.rolls[back]] for back in (ROLL_LEFT, ROLL_RIGHT, ROLL_BACK, ROLL_FRONT)] for layout in layouts]
+    directions = [MOVE_DIRECTIONS[move] for move in MOVES]
+    rolls = array('i', [-1])*(len(tiles)*layout_count)
+    frontier = [i*layout_count + layout for i, tile in enumerate(tiles) if tile == TILE_GOAL for layout in range(layout_count)]
+    for base in frontier:
+        rolls[base] = 0
+    moves = 0
+    while frontier:
+        moves += 1
+        reached = []
+        for base in frontier:
+            position, layout = divmod(base, layout_count)
+            distance = layouts[layout].bottom+1
+            x, y = position % width, position // width
+            for roll, dx, dy in directions:
+                # Walks back along the roll, the tiles passed over and the one landed on can't be walls
+                if not (0 <= x - dx*distance < width and 0 <= y - dy*distance < height):
+                    continue
+                index = position
+                stride = dx + dy*width
+                for s in range(distance):
+                    index -= stride
+                    if tiles[index] == TILE_WALL:
+                        break
+                else:
+                    if tiles[index] != TILE_NONE:
+                        previous = index*layout_count + unrolled[layout][roll]
+                        if rolls[previous] < 0:
+                            rolls[previous] = moves
+                            reached.append(previous)
+        frontier = reached
+    return rolls
+
+# max_states stops the search early, max_moves prunes every state that can't reach a goal within that many moves
+def solve(state: GameState, frames_per_move=FRAMES_PER_MOVE, max_states=None, max_moves=None) -> SolverResult:
+    start_time = time.perf_counter()
+    level = state.level
+    width, height = level.width, level.height
+    tiles = bytes(level.tiles) # Every tile is read many times over, the tiles of a level from a pack are copied out of its chunks
+    if TILE_GOAL not in tiles:
+        return SolverResult(None, 0, 0, time.perf_counter() - start_time)
+
+    layouts = layout_orbit(state.layout, level.die_layout)
+    layout_count = len(layouts)
+    layout_index = {layout: i for i, layout in enumerate(layouts)}
+    rolls = [[layout_index[rolled] for rolled in layout.rolls] for layout in layouts]
+    far = max(layout.bottom for layout in layouts) + 1
+    goal_rolls = goal_distances(width, height, tiles, layouts)
+
+    time_left = level.time # Frames a timed tile stays after it is stepped on, and stays gone
+    restore_after = 2*time_left
+    timed = level.timed
+    start = level.start[1]*width + level.start[0] if level.start else -1
+    start_base = start*layout_count + layout_index[level.die_layout]
+    # A fall puts the die on the start for free, so from a level with timed tiles the start is never further than that
+    start_rolls = goal_rolls[start_base] if timed and start >= 0 else -1
+
+    def heuristic(base: int) -> int:
+        estimate = goal_rolls[base]
+        if start_rolls >= 0 and (estimate < 0 or start_rolls < estimate):
+            return start_rolls
+        return estimate
+
+    # Frames before the die could land on tile b from tile a: a roll moves along a single axis and at most
+    # far tiles, and frames_per_move pass after every roll but the last. A pending tile back by then is dropped.
+    def frames_to(a: int, b: int) -> int:
+        return (-(-abs(a % width - b % width) // far) - (-abs(a // width - b // width) // far) - 1)*frames_per_move
+    timed_x = [index % width for index in timed]
+    timed_y = [index // width for index in timed]
+    from_start = [frames_to(start, index) if start >= 0 else restore_after for index in timed]
+
+    # Lets frames_per_move frames pass, returns the new base and pending
+    def wait(base: int, pending: tuple):
+        position = base // layout_count
+        aged = []
+        fall = False
+        for entry in pending:
+            restore = entry & PENDING_MASK
+            if restore > time_left >= restore - frames_per_move and timed[entry >> PENDING_BITS] == position:
+                fall = True # Vanished under the die
+            if restore > frames_per_move:
+                aged.append(entry - frames_per_move)
+        if fall:
+            base = start_base
+            position = start
+        # Drops the tiles that will be back before the die can land on them, from here or from the start
+        x, y = position % width, position // width
+        kept = []
+        for entry in aged:
+            slot = entry >> PENDING_BITS
+            restore = entry & PENDING_MASK
+            if restore > from_start[slot] or restore > (-(-abs(timed_x[slot] - x) // far) - (-abs(timed_y[slot] - y) // far) - 1)*frames_per_move:
+                kept.append(entry)
+        return base, tuple(kept)
+
+    # Rolls out of a base, (move, landing base, timed slot or -1, reached a goal) each, worked out once per base
+    moves_from = {}
+    def roll_moves(base: int) -> list:
+        position, layout = divmod(base, layout_count)
+        x, y = position % width, position // width
+        found = []
+        for move in MOVES:
+            roll, dx, dy = MOVE_DIRECTIONS[move]
+            rolled = rolls[layout][roll]
+            distance = layouts[rolled].bottom+1
+            if not (0 <= x + dx*distance < width and 0 <= y + dy*distance < height):
+                continue
+            index = position
+            stride = dx + dy*width
+            for s in range(distance):
+                index += stride
+                if tiles[index] == TILE_WALL:
+                    break
+            else:
+                tile = tiles[index]
+                if tile != TILE_NONE:
+                    slot = bisect_left(timed, index) if tile == TILE_TIMED else -1
+                    found.append((move, index*layout_count + rolled, slot, tile == TILE_GOAL))
+        moves_from[base] = found
+        return found
+
+    base = (state.y*width + state.x)*layout_count + layout_index[state.layout]
+    pending = tuple(sorted(slot << PENDING_BITS | (due - state.clock + (time_left if slot not in state.gone else 0)) for due, slot in state.schedule))
+    estimate = heuristic(base)
+    if estimate < 0 or max_moves is not None and estimate > max_moves:
+        return SolverResult(None, 0, 1, time.perf_counter() - start_time)
+    key = (base, pending) if pending else base
+    # Entries are (estimate, -cost, base, pending): deeper states go first among equal estimates
+    frontier = [(estimate, 0, base, pending)]
+    costs = {key: 0}
+    parents = {key: None} # (key, move) a state was reached from
+    explored = 0
+
+    while frontier:
+        f, negative_cost, base, pending = heappop(frontier)
+        cost = -negative_cost
+        key = (base, pending) if pending else base
+        if cost > costs[key]:
+            continue # Stale entry, a cheaper path was found since
+
+        if tiles[base // layout_count] == TILE_GOAL:
+            moves = []
+            while parents[key]:
+                key, move = parents[key]
+                moves.append(move)
+            moves.reverse()
+            return SolverResult(moves, explored, len(costs), time.perf_counter() - start_time)
+
+        explored += 1
+        if max_states and explored >= max_states:
+            break
+
+        successors = []
+        if max_moves is None or cost < max_moves:
+            for move, rolled, slot, goal in moves_from.get(base) or roll_moves(base):
+                after = pending
+                if slot >= 0:
+                    for entry in pending:
+                        if entry >> PENDING_BITS == slot:
+                            if entry & PENDING_MASK <= time_left:
+                                rolled = -1 # Gone
+                            break
+                    else:
+                        # Stepping on an untouched timed tile schedules its vanishing
+                        after = tuple(sorted(pending + (slot << PENDING_BITS | restore_after,)))
+                    if rolled < 0:
+                        continue
+                if after and not goal:
+                    successors.append((*wait(rolled, after), move, cost+1))
+                else:
+                    successors.append((rolled, after, move, cost+1))
+        if pending:
+            successors.append((*wait(base, pending), MOVE_WAIT, cost))
+
+        for successor, after, move, successor_cost in successors:
+            successor_key = (successor, after) if after else successor
+            if successor_cost < costs.get(successor_key, successor_cost+1):
+                estimate = heuristic(successor)
+                if estimate < 0:
+                    continue # No goal can be reached from there
+                estimate += successor_cost
+                if max_moves is not None and estimate > max_moves:
+                    continue # The heuristic never overestimates, so no goal is close enough from there
+                costs[successor_key] = successor_cost
+                parents[successor_key] = (key, move)
+                heappush(frontier, (estimate, -successor_cost, successor, after))
+
+    return SolverResult(None, explored, len(costs), time.perf_counter() - start_time)
+
+def solve_level(lvl: int, directory=LEVELS_DIRECTORY, **kwargs) -> SolverResult:
+    return solve(initial_state(load_level(lvl, directory)), **kwargs)
+
+
+if __name__ == '__main__':
+    for lvl in sys.argv[1:] or range(len(load_level_data())):
+        print(f'Level {lvl}: {solve_level(int(lvl))}')
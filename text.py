@@ -1,8 +1,16 @@
 import pygame
 from pygame.math import Vector2 as vec2
+from collections import OrderedDict
+from functools import partial
 
 from spritesheet import spritesheet
 
+
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+GLYPH_ADVANCE = 6
+TEXT_CACHE_SIZE = 128 # Maximum number of rendered strings kept around
+
 class Text:
     def __init__(self, text: str, pos: vec2, follow_camera=True):
         self.text = text
@@ -10,7 +18,7 @@ class Text:
         self.follow_camera = follow_camera
 
 class Typer(Text):
-    def __init__(self, text: str, pos: vec2, delay, sfx: pygame.mixer.Sound=None, follow_camera=True):
+    def __init__(self, text: str, pos: vec2, delay, sfx=None, follow_camera=True):
         super().__init__('', pos, follow_camera)
         self.full_text = text
 
@@ -24,7 +32,7 @@ class Typer(Text):
         if len(self.full_text) > self.cursor:
             if self.tick >= self.delay:
                 if self.sfx and self.full_text[self.cursor] != ' ':
-                    self.sfx.play()
+                    self.sfx() # Plays the typing sound
                 self.tick = 0
                 self.text += self.full_text[self.cursor]
                 self.cursor += 1
@@ -37,28 +45,50 @@ class TextManager:
         self.gm = gm
         self.ss = spritesheet('img/text.png')
         self.texts = []
+
+        # Glyphs are sliced from the sheet once, starting at ' '
+        self.glyphs = self.ss.load_strip([0, 0, GLYPH_WIDTH, GLYPH_HEIGHT], self.ss.sheet.get_width()//GLYPH_WIDTH, (0, 0, 0))
+        self.cache = OrderedDict()
     
     def load(self, texts):
         self.texts = []
         for t in texts:
             if t['delay']:
-                self.texts.append( Typer(t['text'], vec2(t['pos']), t['delay'], self.gm.sounds['type'], t['follow_camera']) )
+                self.texts.append( Typer(t['text'], vec2(t['pos']), t['delay'], partial(self.gm.play_sound, 'type'), t['follow_camera']) )
             else:
                 self.texts.append( Text(t['text'], vec2(t['pos']), t['follow_camera']) )
     
-    def blit(self, text: str, pos: vec2):
-        width = len(text)*6
-        surf = pygame.Surface((width, 7))
+    def _blit_glyph(self, surf: pygame.Surface, c: str, x: int):
+        index = ord(c)-32
+        if 0 <= index < len(self.glyphs):
+            surf.blit(self.glyphs[index], (x, 0))
+    
+    # Returns the rendered string, strings are cached and built on top of their cached prefix if there is one
+    def render(self, text: str) -> pygame.Surface:
+        surf = self.cache.get(text)
+        if surf is not None:
+            self.cache.move_to_end(text)
+            return surf
+
+        surf = pygame.Surface((len(text)*GLYPH_ADVANCE, GLYPH_HEIGHT)).convert()
         surf.fill((0, 0, 0))
         surf.set_colorkey((0, 0, 0))
-        i = 0
-        for c in text:
-            surf.blit(
-                self.ss.image_at([ (ord(c)-32)*5, 0, 5, 7], (0, 0, 0)),
-                (i, 0)
-            )
-            i += 6
-        self.gm.screen.blit(surf, pos)
+
+        prefix = self.cache.get(text[:-1]) if text else None
+        if prefix is not None:
+            surf.blit(prefix, (0, 0))
+            self._blit_glyph(surf, text[-1], (len(text)-1)*GLYPH_ADVANCE)
+        else:
+            for i, c in enumerate(text):
+                self._blit_glyph(surf, c, i*GLYPH_ADVANCE)
+        
+        self.cache[text] = surf
+        if len(self.cache) > TEXT_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return surf
+    
+    def blit(self, text: str, pos: vec2):
+        self.gm.screen.blit(self.render(text), pos)
     
     def update(self):
         for t in self.texts:
@@ -0,0 +1,104 @@
+# Checks every level in levels/dat.json against its image and solves it, spreading the levels over all cores.
+# Prints a JSON report and exits with an error code when a level is invalid.
+#   python validate_levels.py [--levels DIRECTORY] [--workers N] [--output FILE]
+
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1') # Keeps stdout clean for the report
+
+from constants import SOUNDS, BACKGROUNDS
+from simulation import *
+from solver import solve, FRAMES_PER_MOVE
+
+
+# The last level has no goal, reaching a goal loads the next level
+def validate_level(lvl: int, data: dict, directory: str, last: bool, frames_per_move: int, max_states: int) -> dict:
+    start_time = time.perf_counter()
+    report = {'level': lvl, 'errors': []}
+    errors = report['errors']
+
+    if data.get('background') not in BACKGROUNDS:
+        errors.append(f'unknown background {data.get("background")!r}')
+    for music in data.get('music') or []:
+        if music not in SOUNDS:
+            errors.append(f'unknown music {music!r}')
+
+    try:
+        layout = data['die_layout']
+        if len(layout) != 6:
+            raise ValueError(f'expected 6 faces, got {len(layout)}')
+        DieLayout.fromlist(layout)
+    except (KeyError, TypeError, ValueError) as e:
+        errors.append(f'invalid die_layout: {e}')
+
+    try:
+        decode_start = time.perf_counter()
+        width, height, tiles = decode_level_image(f'{directory}/{lvl}.png')
+        report['decode_time'] = time.perf_counter() - decode_start
+    except Exception as e:
+        errors.append(f'could not decode image: {e}')
+        return report
+    
+    report['size'] = [width, height]
+    starts = tiles.count(TILE_START)
+    if starts != 1:
+        errors.append(f'expected exactly one start tile, found {starts}')
+    goals = tiles.count(TILE_GOAL)
+    if last and goals:
+        errors.append('the last level has a goal tile but there is no level after it')
+    elif not last and not goals:
+        errors.append('no goal tile')
+
+    if not errors and not last:
+        result = solve(initial_state(Level(width, height, tiles, data)), frames_per_move=frames_per_move, max_states=max_states)
+        report['solve_time'] = result.elapsed
+        report['explored'] = result.explored
+        if result.solved:
+            report['moves'] = result.length
+            report['solution'] = result.moves
+        else:
+            errors.append('goal is not reachable' if not max_states or result.explored < max_states else f'not solved within {max_states} states')
+    
+    report['time'] = time.perf_counter() - start_time
+    return report
+
+def validate_levels(directory=LEVELS_DIRECTORY, workers=None, frames_per_move=FRAMES_PER_MOVE, max_states=None) -> list:
+    levels = load_level_data(directory)
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(validate_level, lvl, data, directory, lvl == len(levels)-1, frames_per_move, max_states)
+            for lvl, data in enumerate(levels)
+        ]
+        return [future.result() for future in futures]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate and solve every level of a level directory.')
+    parser.add_argument('--levels', default=LEVELS_DIRECTORY, help='directory holding dat.json and the level images')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    parser.add_argument('--frames-per-move', type=int, default=FRAMES_PER_MOVE, help='frames assumed between two moves')
+    parser.add_argument('--max-states', type=int, default=None, help='give up on a level after exploring this many states')
+    parser.add_argument('-o', '--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    reports = validate_levels(args.levels, args.workers, args.frames_per_move, args.max_states)
+    summary = {
+        'levels': len(reports),
+        'invalid': [report['level'] for report in reports if report['errors']],
+        'time': time.perf_counter() - start_time,
+        'reports': reports,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=4)
+    else:
+        json.dump(summary, sys.stdout, indent=4)
+        print()
+    sys.exit(1 if summary['invalid'] else 0)